@@ -0,0 +1,463 @@
+# ============================================================================
+# OFFLINE PIPELINE BENCHMARK
+# ============================================================================
+"""
+Measure the render pipeline in code.py without live API keys.
+
+Synthetic OBD traces (1 Hz, with stops and accelerate/cruise/brake speed
+profiles) are written to CSV and pushed through each stage. Mapbox static
+maps, map matching and Street View are answered by local mock servers with
+a configurable latency. Each trip size runs in a fresh interpreter, so the
+peak RSS reported for a stage is the high-water mark of that run up to and
+including the stage.
+
+    python benchmark.py                                  # 1k, 10k, 100k, 1M points
+    python benchmark.py --sizes 1000,10000 --output baseline.json
+    python benchmark.py --sizes 1000,10000 --compare baseline.json
+    python benchmark.py --check                          # offline correctness checks only
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import urlsplit, unquote
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows: RSS is not reported
+    resource = None
+
+CODE_PY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code.py')
+
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+DEFAULT_LATENCY_MS = 20
+DEFAULT_RENDER_FRAMES = 600       # render stage is capped; frames/s is what matters
+REGRESSION_TOLERANCE = 0.20       # fraction slower than baseline that counts as a regression
+REGRESSION_MIN_SECONDS = 0.05     # ignore noise on stages this fast
+
+STAGES = ['load', 'load_cached', 'process_gps_data', 'detect_stops',
+          'capture_stop_photos', 'generate_adaptive_frames', 'render']
+
+SEAM_CHECK_SIZES = (1, 2, 100, 101, 191, 10000)
+SEAM_CHECK_WINDOWS = [(None, None), (5, 2), (7, 3)]   # (batch_size, overlap); None = production setting
+MATCH_SHIFT = (1e-3, -2e-3)       # (lon, lat) the mock adds to every point in --check
+TIMESTAMP_CHECK_STOP = (150, 450) # rows of the 300 s stop in the timestamp check trip
+
+# ============================================================================
+# SYNTHETIC TRIPS
+# ============================================================================
+def synthetic_trip(n_points, seed=0, start=(40.7128, -74.0060)):
+    """
+    A 1 Hz drive of n_points samples: driving legs that ramp up to a cruise
+    speed and back down, separated by stops long enough to be detected, with
+    gentle heading drift, occasional 90 degree turns and ~3 m GPS noise.
+    """
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+
+    speed = np.zeros(n_points)
+    i = 0
+    while i < n_points:
+        leg = int(rng.integers(300, 1500))
+        cruise = rng.uniform(30, 110)
+        ramp = max(1, min(30, leg // 3))
+        t = np.arange(leg)
+        envelope = np.minimum(1.0, np.minimum(t + 1, leg - t) / ramp)
+        speed[i:i + leg] = np.clip(cruise * envelope + rng.normal(0, 2, leg), 0, None)[:n_points - i]
+        i += leg + int(rng.integers(100, 300))  # stationary gap stays at 0 km/h
+
+    moving = speed > 0
+    turn = rng.normal(0, 0.3, n_points)
+    for at in rng.choice(n_points, size=max(1, n_points // 400), replace=False):
+        turn[at:at + 6] += rng.choice([-15.0, 15.0])  # 90 degrees over 6 s
+    heading = np.radians(rng.uniform(0, 360) + np.cumsum(turn * moving))
+
+    step_m = speed / 3.6
+    north = np.cumsum(step_m * np.cos(heading)) + rng.normal(0, 3, n_points)
+    east = np.cumsum(step_m * np.sin(heading)) + rng.normal(0, 3, n_points)
+    lat = start[0] + north / 111320.0
+    lon = start[1] + east / (111320.0 * np.cos(np.radians(start[0])))
+
+    timestamps = pd.Timestamp('2024-01-01 08:00:00') + pd.to_timedelta(np.arange(n_points), unit='s')
+    return pd.DataFrame({'Timestamp': timestamps, 'Latitude': lat, 'Longitude': lon,
+                         'Speed': speed.round(1)})
+
+# ============================================================================
+# MOCK API SERVERS
+# ============================================================================
+def _encoded_image(size, fmt):
+    from PIL import Image
+    width, height = size
+    gradient = np.linspace(0, 255, width, dtype=np.uint8)
+    pixels = np.dstack([np.tile(gradient, (height, 1))] * 3)
+    buf = BytesIO()
+    Image.fromarray(pixels).save(buf, format=fmt)
+    return buf.getvalue()
+
+class MockApiServer:
+    """
+    One local HTTP server standing in for both Mapbox and Google:
+      /styles/v1/.../static/...          -> PNG
+      /matching/v5/mapbox/<profile>/...  -> tracepoints echoing the input (+ match_shift)
+      /maps/api/streetview/metadata      -> {"status": "OK"}
+      /maps/api/streetview               -> JPEG
+    Every response is delayed by latency_ms to model the network.
+    """
+    def __init__(self, latency_ms=DEFAULT_LATENCY_MS):
+        self.latency = latency_ms / 1000.0
+        self.match_shift = (0.0, 0.0)
+        self.requests = {}
+        self._lock = threading.Lock()
+        self.map_png = _encoded_image((800, 600), 'PNG')
+        self.photo_jpeg = _encoded_image((600, 400), 'JPEG')
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def handle(self, request):
+        path = urlsplit(request.path).path
+        if path.startswith('/styles/v1/'):
+            kind, body, ctype = 'static_map', self.map_png, 'image/png'
+        elif path.startswith('/matching/v5/'):
+            coords = unquote(path.rsplit('/', 1)[1]).split(';')
+            tracepoints = [{'location': [float(v) + d for v, d in zip(c.split(','), self.match_shift)]} for c in coords]
+            kind, ctype = 'map_matching', 'application/json'
+            body = json.dumps({'code': 'Ok', 'tracepoints': tracepoints}).encode('utf-8')
+        elif path == '/maps/api/streetview/metadata':
+            kind, body, ctype = 'streetview_metadata', b'{"status": "OK"}', 'application/json'
+        elif path == '/maps/api/streetview':
+            kind, body, ctype = 'streetview_photo', self.photo_jpeg, 'image/jpeg'
+        else:
+            kind, body, ctype = 'not_found', b'', 'text/plain'
+
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+        time.sleep(self.latency)
+        request.send_response(404 if kind == 'not_found' else 200)
+        request.send_header('Content-Type', ctype)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def take_counts(self):
+        with self._lock:
+            counts, self.requests = self.requests, {}
+        return counts
+
+# ============================================================================
+# SINGLE RUN (child process)
+# ============================================================================
+def peak_rss_mb():
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def load_pipeline():
+    """Import code.py under its own name ('code' would shadow the stdlib module)."""
+    spec = importlib.util.spec_from_file_location('trip_renderer', CODE_PY_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def run_stages(trip_path, work_dir, render_frames, keep_rate_limits=False):
+    """Run every stage once on trip_path; returns {'stages': {...}, 'frames_per_s', 'detail', 'counters'}."""
+    pipeline = load_pipeline()
+    if not keep_rate_limits:
+        # The mocks do not throttle, so the limiters would only measure themselves
+        pipeline.MAP_MATCHING_RATE_LIMIT = 0
+        pipeline.STREETVIEW_RATE_LIMIT = 0
+    telemetry = pipeline._job_context.telemetry = pipeline.Telemetry()
+
+    stages = {}
+    def timed(name, fn, *args, **kwargs):
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            result = fn(*args, **kwargs)
+        stages[name] = {'wall_s': round(time.perf_counter() - started, 4), 'peak_rss_mb': peak_rss_mb()}
+        return result
+
+    timed('load', pipeline.load_trip, trip_path)
+    gps_df = timed('load_cached', pipeline.load_trip, trip_path)
+    gps_df = timed('process_gps_data', pipeline.process_gps_data, gps_df)
+    stops = timed('detect_stops', pipeline.detect_stops, gps_df)
+    photo_data = timed('capture_stop_photos', pipeline.capture_stop_photos, gps_df, stops,
+                       photo_dir=os.path.join(work_dir, 'photos'))
+    positions = timed('generate_adaptive_frames', pipeline.generate_adaptive_frames, gps_df)
+    positions = positions[:render_frames]
+    timed('render', pipeline.render_video_static_fallback, positions, gps_df, photo_data,
+          os.path.join(work_dir, 'render.mp4'))
+
+    summary = telemetry.summary()
+    render_s = stages['render']['wall_s']
+    return {
+        'points': len(gps_df),
+        'stops': len(stops),
+        'frames_rendered': len(positions),
+        'frames_per_s': round(len(positions) / render_s, 2) if render_s else None,
+        'stages': stages,
+        'detail': summary['stages'],
+        'counters': summary['counters'],
+    }
+
+# ============================================================================
+# CORRECTNESS CHECKS
+# ============================================================================
+def check_map_matching(server, sizes=SEAM_CHECK_SIZES):
+    """
+    Map-matching window seams: every point must be owned by exactly one
+    window, inside that window's request, and the stitched route must put
+    each matched location back at its own index. The mock shifts every point
+    by MATCH_SHIFT, so an off-by-one at a seam shows up as a neighbour's
+    coordinates. Returns a list of failure messages.
+    """
+    pipeline = load_pipeline()
+    failures = []
+    for n in sizes:
+        for batch_size, overlap in SEAM_CHECK_WINDOWS:
+            kwargs = {} if batch_size is None else {'batch_size': batch_size, 'overlap': overlap}
+            windows = pipeline.map_matching_windows(n, **kwargs)
+            owners = np.zeros(n, dtype=int)
+            for start, stop, own_start, own_stop in windows:
+                if not start <= own_start <= own_stop <= stop:
+                    failures.append(f"n={n} {kwargs}: window {(start, stop)} owns [{own_start}, {own_stop})")
+                owners[own_start:own_stop] += 1
+            bad = np.flatnonzero(owners != 1)
+            if len(bad):
+                failures.append(f"n={n} {kwargs}: {len(bad)} points not owned exactly once, first at {bad[0]}")
+
+    with tempfile.TemporaryDirectory(prefix='bench-check-') as cache_dir:
+        pipeline.MAPBOX_API_BASE = server.base_url
+        pipeline.MAP_MATCHING_CACHE_DIR = cache_dir
+        pipeline.MAP_MATCHING_RATE_LIMIT = 0
+        server.match_shift = MATCH_SHIFT
+        for n in sizes:
+            # A straight line, so no two points share coordinates
+            lats = np.linspace(40.0, 40.0 + n * 1e-4, n)
+            lons = np.linspace(-74.0, -74.0 + n * 1e-4, n)
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                out_lats, out_lons, matched = pipeline.map_match_route(lats, lons)
+            # A single point is never sent, so it keeps its raw position
+            shift = MATCH_SHIFT if n > 1 else (0.0, 0.0)
+            expected = n if n > 1 else 0
+            wrong = np.flatnonzero((np.abs(out_lons - (lons + shift[0])) > 2e-6) |
+                                   (np.abs(out_lats - (lats + shift[1])) > 2e-6))
+            if len(wrong):
+                failures.append(f"n={n}: {len(wrong)} matched points at the wrong index, first at {wrong[0]}")
+            if matched != expected:
+                failures.append(f"n={n}: {matched} points matched, expected {expected}")
+        server.match_shift = (0.0, 0.0)
+    return failures
+
+def timestamp_check_trip(n_points=600, stop=TIMESTAMP_CHECK_STOP):
+    """1 Hz trip at 36 km/h with one stop; returns (DataFrame, start datetime)."""
+    import pandas as pd
+    speed = np.full(n_points, 36.0)
+    speed[stop[0]:stop[1]] = 0.0
+    lats = 40.0 + np.cumsum(np.where(speed > 0, 9e-5, 0.0))
+    df = pd.DataFrame({'Latitude': lats, 'Longitude': np.full(n_points, -74.0), 'Speed': speed})
+    return df, pd.Timestamp('2024-05-01 08:00:00')
+
+def check_trip_timestamps(shapes=None):
+    """
+    Upload timestamp shapes: real clocks must be kept (and find the stop from
+    their own durations); date-only or constant columns must be dropped so
+    the loader synthesizes timings. Returns a list of failure messages.
+    """
+    import pandas as pd
+    pipeline = load_pipeline()
+    base, start = timestamp_check_trip()
+    clock = start + pd.to_timedelta(np.arange(len(base)), unit='s')
+    expected_stop = (TIMESTAMP_CHECK_STOP[0] + TIMESTAMP_CHECK_STOP[1]) // 2
+    # name -> (file extension, extra columns, Timestamp kept)
+    shapes = shapes or {
+        'iso datetime': ('.csv', {'timestamp': clock.strftime('%Y-%m-%dT%H:%M:%SZ')}, True),
+        'elapsed seconds': ('.csv', {'time_s': np.arange(len(base))}, True),
+        'epoch milliseconds': ('.csv', {'time_ms': (clock - pd.Timestamp(0)) // pd.Timedelta('1ms')}, True),
+        'date and time columns': ('.xlsx', {'Date': clock.normalize(), 'Time': clock.time}, True),
+        'date only': ('.xlsx', {'Date': clock.normalize()}, False),
+        'constant timestamp': ('.csv', {'timestamp': [start.isoformat()] * len(base)}, False),
+    }
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='bench-check-') as work_dir:
+        for name, (ext, columns, kept) in shapes.items():
+            path = os.path.join(work_dir, f"trip{ext}")
+            trip = base.assign(**columns)
+            if ext == '.csv':
+                trip.to_csv(path, index=False)
+            else:
+                trip.to_excel(path, index=False)
+            df = pipeline.load_trip(path, use_cache=False)
+            if ('Timestamp' in df.columns) != kept:
+                failures.append(f"{name}: Timestamp {'dropped' if kept else 'kept'}")
+            elif kept and (df['Timestamp'].iloc[-1] - df['Timestamp'].iloc[0]).total_seconds() != len(base) - 1:
+                failures.append(f"{name}: trip spans {df['Timestamp'].iloc[-1] - df['Timestamp'].iloc[0]}")
+            seg_m = pipeline.haversine_distance_np(df['Latitude'].to_numpy()[:-1], df['Longitude'].to_numpy()[:-1],
+                                                   df['Latitude'].to_numpy()[1:], df['Longitude'].to_numpy()[1:])
+            df['Distance_km'] = np.concatenate([[0.0], np.cumsum(seg_m) / 1000])
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                stops = pipeline.detect_stops(df)
+            if stops != [expected_stop]:
+                failures.append(f"{name}: stops at {stops}, expected [{expected_stop}]")
+    return failures
+
+def run_checks(args):
+    with MockApiServer(latency_ms=0) as server:
+        failures = check_map_matching(server)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"map matching seams: {'FAILED' if failures else 'ok'} (sizes {', '.join(map(str, SEAM_CHECK_SIZES))})")
+    timestamp_failures = check_trip_timestamps()
+    for failure in timestamp_failures:
+        print(f"FAIL {failure}")
+    print(f"trip timestamps: {'FAILED' if timestamp_failures else 'ok'}")
+    return 1 if failures or timestamp_failures else 0
+
+# ============================================================================
+# ORCHESTRATION
+# ============================================================================
+def run_size(n_points, server, args):
+    with tempfile.TemporaryDirectory(prefix=f'bench-{n_points}-') as work_dir:
+        trip_path = os.path.join(work_dir, 'trip.csv')
+        synthetic_trip(n_points, seed=args.seed).to_csv(trip_path, index=False)
+        result_path = os.path.join(work_dir, 'result.json')
+
+        # Fresh caches per size, so every run starts cold
+        cache_dir = os.path.join(work_dir, 'cache')
+        env = dict(os.environ,
+                   MAPBOX_API_KEY='benchmark', GOOGLE_API_KEY='benchmark',
+                   MAPBOX_API_BASE=server.base_url, GOOGLE_API_BASE=server.base_url,
+                   MAP_CACHE_DIR=os.path.join(cache_dir, 'static_maps'),
+                   STREETVIEW_CACHE_DIR=os.path.join(cache_dir, 'streetview'),
+                   MAP_MATCHING_CACHE_DIR=os.path.join(cache_dir, 'map_matching'),
+                   TRIP_CACHE_DIR=os.path.join(cache_dir, 'trips'),
+                   # Render processes re-import the pipeline by module name, which
+                   # they cannot do for code.py loaded as 'trip_renderer'
+                   RENDER_WORKERS='1')
+        cmd = [sys.executable, os.path.abspath(__file__), '--run-trip', trip_path,
+               '--work-dir', work_dir, '--result', result_path,
+               '--render-frames', str(args.render_frames)]
+        if args.keep_rate_limits: cmd.append('--keep-rate-limits')
+
+        server.take_counts()
+        proc = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{n_points}-point run failed:\n{proc.stderr[-2000:]}")
+        with open(result_path) as f:
+            result = json.load(f)
+        result['api_requests'] = server.take_counts()
+        return result
+
+def compare(results, baseline_path):
+    """Print per-stage ratios against a saved baseline; returns the list of regressions."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    print(f"\nComparison with {baseline_path}:")
+    for size, result in results.items():
+        old = baseline.get(size)
+        if old is None: continue
+        for stage, now in result['stages'].items():
+            before = old['stages'].get(stage)
+            if before is None: continue
+            ratio = now['wall_s'] / before['wall_s'] if before['wall_s'] else float('inf')
+            slower = now['wall_s'] - before['wall_s']
+            flag = ratio > 1 + REGRESSION_TOLERANCE and slower > REGRESSION_MIN_SECONDS
+            if flag: regressions.append((size, stage, before['wall_s'], now['wall_s']))
+            print(f"  {size:>8} {stage:<26} {before['wall_s']:>9.3f}s -> {now['wall_s']:>9.3f}s "
+                  f"x{ratio:5.2f}{'  REGRESSION' if flag else ''}")
+    return regressions
+
+def print_table(results):
+    print(f"{'points':>8} {'stage':<26} {'wall_s':>10} {'peak_rss_mb':>12}")
+    for size, result in results.items():
+        for stage, row in result['stages'].items():
+            rss = '-' if row['peak_rss_mb'] is None else f"{row['peak_rss_mb']:.1f}"
+            print(f"{size:>8} {stage:<26} {row['wall_s']:>10.3f} {rss:>12}")
+        print(f"{size:>8} {'frames/s':<26} {result['frames_per_s']:>10}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the render pipeline against local API mocks.")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="Comma-separated trip sizes in points")
+    parser.add_argument('--latency-ms', type=float, default=DEFAULT_LATENCY_MS, help="Mock API latency per request")
+    parser.add_argument('--render-frames', type=int, default=DEFAULT_RENDER_FRAMES, help="Frames rendered per size")
+    parser.add_argument('--seed', type=int, default=0, help="Synthetic trip seed")
+    parser.add_argument('--keep-rate-limits', action='store_true', help="Keep the production API rate limiters")
+    parser.add_argument('--output', help="Write results as JSON (use as a baseline later)")
+    parser.add_argument('--compare', help="Baseline JSON to compare against; exits 1 on regression")
+    parser.add_argument('--check', action='store_true', help="Run the offline correctness checks instead; exits 1 on failure")
+    # Internal: a single measured run in a fresh interpreter
+    parser.add_argument('--run-trip', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.run_trip:
+        result = run_stages(args.run_trip, args.work_dir, args.render_frames, args.keep_rate_limits)
+        with open(args.result, 'w') as f:
+            json.dump(result, f)
+        return 0
+    if args.check:
+        return run_checks(args)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    results = {}
+    with MockApiServer(args.latency_ms) as server:
+        for n_points in sizes:
+            print(f"Running {n_points} points...", file=sys.stderr)
+            results[str(n_points)] = run_size(n_points, server, args)
+
+    print_table(results)
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'latency_ms': args.latency_ms,
+            'render_frames': args.render_frames,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.compare and compare(results, args.compare):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
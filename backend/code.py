@@ -4,11 +4,18 @@
 import subprocess
 import sys
 import os
-import base64
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import multiprocessing
+import shutil
 import json
 import time
+import hashlib
+import heapq
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from contextlib import contextmanager, nullcontext
 
 # FORCE UNBUFFERED OUTPUT (CRITICAL FOR STREAMING)
 sys.stdout.reconfigure(line_buffering=True)
@@ -44,62 +51,77 @@ UPLOADS_BASE_DIR, FRAMES_DIR, PHOTO_DIR, VIDEOS_DIR = setup_environment()
 OUTPUT_DIR = UPLOADS_BASE_DIR
 
 # --- SILENT MODE INSTALLER ---
+# Not run at import: provisioning belongs to deployment, and apt/pip here added
+# tens of seconds to every upload. Run once with `python code.py --install`.
 def install_system_packages():
     if sys.platform == 'win32': return
     try:
         subprocess.run(['apt-get', 'update'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        subprocess.run(['apt-get', 'install', '-y', 'chromium-browser', 'chromium-chromedriver', 'ffmpeg'], 
+        subprocess.run(['apt-get', 'install', '-y', 'ffmpeg'], 
                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     except: pass
 
 def install_python_packages():
     try:
-        import pandas, numpy, imageio, PIL, scipy, selenium
+        import pandas, numpy, imageio_ffmpeg, PIL, scipy, requests, pyarrow
         return
     except ImportError:
         pass
-    packages = ['selenium', 'pandas', 'numpy', 'pyproj', 'imageio', 'imageio-ffmpeg', 'pillow', 'requests', 'openpyxl', 'scipy', 'webdriver-manager']
-    subprocess.run([sys.executable, 'pip', 'install', '-q'] + packages, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-install_system_packages()
-install_python_packages()
+    packages = ['pandas', 'numpy', 'imageio-ffmpeg', 'pillow', 'requests', 'openpyxl', 'pyarrow', 'scipy']
+    subprocess.run([sys.executable, '-m', 'pip', 'install', '-q'] + packages, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
 # ============================================================================
 # IMPORTS & UTILS
 # ============================================================================
+# Only cheap modules are imported here. pandas, scipy, imageio_ffmpeg and requests
+# are imported inside the stages that use them (see benchmark_startup).
 import math
 from io import BytesIO
-from datetime import datetime, timedelta
-import pandas as pd
+from datetime import datetime
 import numpy as np
-import imageio.v2 as imageio
 from PIL import Image, ImageDraw, ImageFont
-import requests
-from scipy.ndimage import gaussian_filter1d
-from pyproj import Geod
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from webdriver_manager.core.os_manager import ChromeType
 
 # --- CRITICAL: DISABLE TQDM FOR WEB STREAMING ---
 def tqdm(iterable, *args, **kwargs):
     return iterable
 
-geod = Geod(ellps="WGS84")
-
 # CONFIGURATION
 MAPBOX_API_KEY = os.getenv('MAPBOX_API_KEY')
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 MAP_STYLE = "mapbox://styles/mapbox/satellite-streets-v12"
+MAPBOX_API_BASE = os.getenv('MAPBOX_API_BASE', 'https://api.mapbox.com')
+MAP_IMAGE_SIZE = "800x600@2x"
+MAP_CACHE_DIR = os.getenv('MAP_CACHE_DIR', os.path.join(UPLOADS_BASE_DIR, 'cache', 'static_maps'))
+MAP_CACHE_MAX_MB = int(os.getenv('MAP_CACHE_MAX_MB', '2048'))
+MAP_CACHE_COORD_DECIMALS = 5   # ~1 m; frames closer than this share an image
+MAP_FETCH_WORKERS = 8          # concurrent background downloads per job
+MAP_PREFETCH_AHEAD = 32        # decoded backgrounds buffered ahead of the renderer
+MAP_FETCH_RETRIES = 3
+# Local tile mosaic: set MAP_TILE_SOURCE (a {z}/{x}/{y}.png directory or an .mbtiles
+# file) and/or MAP_TILE_URL (an XYZ template with {z} {x} {y} and optional {token},
+# e.g. .../styles/v1/mapbox/satellite-streets-v12/tiles/256/{z}/{x}/{y}?access_token={token})
+# to render backgrounds from tiles instead of one Static Images request per frame.
+MAP_TILE_SOURCE = os.getenv('MAP_TILE_SOURCE')
+MAP_TILE_URL = os.getenv('MAP_TILE_URL')
+MAP_TILE_CACHE_DIR = os.getenv('MAP_TILE_CACHE_DIR', os.path.join(UPLOADS_BASE_DIR, 'cache', 'tiles'))
+MAP_TILE_SIZE = int(os.getenv('MAP_TILE_SIZE', '256'))   # source tile edge in pixels
+MAP_TILE_MAX_ZOOM = int(os.getenv('MAP_TILE_MAX_ZOOM', '19'))
+MAP_TILE_MEMORY_TILES = 512    # decoded tiles kept in memory (~100 MB at 256 px)
+MAP_TILE_MAX_PITCH = 60        # same cap as the Static Images API; higher tilts reach the horizon
+MAP_TILE_FILL = (20, 20, 20)   # colour for tiles the source does not have
+MAP_TILE_RETRY_AFTER = 30      # seconds before a tile that failed to download is tried again
+MAP_CAMERA_ALTITUDE = 1.5      # camera distance in viewport heights (Mapbox GL convention)
 VIDEO_FPS = 30
 VIDEO_WIDTH = 1400
 VIDEO_HEIGHT = 1050
-ADAPTIVE_SAMPLING = True
+ADAPTIVE_SAMPLING = True       # spend the frame budget on turns, speed changes and stops
 TARGET_VIDEO_DURATION_MINUTES = 3
 MIN_FRAMES_PER_SEGMENT = 1
 MAX_FRAMES_PER_SEGMENT = 8
+SIMPLIFY_TOLERANCE_M = 3.0     # Douglas-Peucker tolerance for the camera path (coarser if the budget needs it)
+FRAME_WEIGHT_TURN = 2.0        # allocation weight per 90 degrees of turn at a segment's ends
+FRAME_WEIGHT_SPEED_CHANGE = 1.0   # ... per 10 km/h of speed change across a segment
+FRAME_WEIGHT_STOP = 3.0        # ... for a segment spent stationary
 CAMERA_ZOOM_BASE = 17.0
 CAMERA_ZOOM_MIN = 16.0
 CAMERA_ZOOM_MAX = 18.0
@@ -116,10 +138,27 @@ STOP_MIN_DURATION = 90
 STOP_MIN_DISTANCE = 50
 MAX_STOP_PHOTOS = 20
 STOP_PHOTO_DISPLAY_DURATION = 3
+GOOGLE_API_BASE = os.getenv('GOOGLE_API_BASE', 'https://maps.googleapis.com')
+STREETVIEW_SIZE = "600x400"
+STREETVIEW_WORKERS = 4
+STREETVIEW_RATE_LIMIT = 10      # requests/second across metadata + image calls
+STREETVIEW_CACHE_DIR = os.getenv('STREETVIEW_CACHE_DIR', os.path.join(UPLOADS_BASE_DIR, 'cache', 'streetview'))
 USE_MAP_MATCHING = True
 MAP_MATCHING_PROFILE = 'driving'
-MAP_MATCHING_BATCH_SIZE = 100
+MAP_MATCHING_BATCH_SIZE = 100   # API maximum coordinates per request
+MAP_MATCHING_OVERLAP = 10       # points shared by neighbouring windows, split at the seam
 MAP_MATCHING_RADIUS = 50
+MAP_MATCHING_WORKERS = 4
+MAP_MATCHING_RATE_LIMIT = 5     # requests/second (Mapbox allows 300/min)
+MAP_MATCHING_CACHE_DIR = os.getenv('MAP_MATCHING_CACHE_DIR', os.path.join(UPLOADS_BASE_DIR, 'cache', 'map_matching'))
+TRIP_CACHE_DIR = os.getenv('TRIP_CACHE_DIR', os.path.join(UPLOADS_BASE_DIR, 'cache', 'trips'))
+TRIP_CACHE_VERSION = 2          # bump when loader output changes to invalidate cached trips
+CHECKPOINT_DIR = os.getenv('CHECKPOINT_DIR')   # default: <job uploads_dir>/cache/checkpoints
+# Encoded segments double a render's disk use (a second copy of every rendition), so opt-in
+SEGMENT_CHECKPOINTS = os.getenv('SEGMENT_CHECKPOINTS', '0') == '1'
+CHECKPOINT_MAX_MB = int(os.getenv('CHECKPOINT_MAX_MB', '4096'))
+CHECKPOINT_VERSION = 2          # bump when a stage's stored format changes
+CSV_CHUNK_ROWS = 200000
 SMOOTH_WINDOW = 5
 USE_GAUSSIAN_SMOOTHING = True
 OUTPUT_VIDEO = os.path.join(VIDEOS_DIR, "relive_full_quality.mp4")
@@ -127,31 +166,157 @@ HTML_FILE = os.path.join(VIDEOS_DIR, "map_viewer_full.html")
 BROWSER_TIMEOUT = 60
 FRAME_WAIT = 0.12
 ENCODING_CRF = 20
+RENDITION_HEIGHT = 720          # mobile / progressive-playback rendition
+RENDITION_CRF = 23
+THUMBNAIL_WIDTH = 320
 ENCODING_PRESET = 'medium'
+SEGMENT_ENCODING_PRESET = 'ultrafast'   # x264 preset for per-segment encodes (full, rendition)
+WORKER_MAX_JOBS = int(os.getenv('WORKER_MAX_JOBS', '2'))   # concurrent jobs in --worker mode
+PROGRESS_MIN_INTERVAL = float(os.getenv('PROGRESS_MIN_INTERVAL', '0.5'))   # seconds between progress lines within a step
+BACKGROUND_REFRESH_INTERVAL = 3   # fetch a new map background every N frames
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '1'))   # >1 renders segments in parallel
+RENDER_CHUNK_FRAMES = int(os.getenv('RENDER_CHUNK_FRAMES', '600'))
 
 # ============================================================================
 # OPTIMIZED PROGRESS HELPER (Aggressive flushing)
 # ============================================================================
-def send_progress(step_name, percent, message="", stage="processing"):
+class JobCancelled(Exception):
+    pass
+
+# Per-thread job context; in --worker mode each job runs on its own thread
+_job_context = threading.local()
+_output_lock = threading.Lock()
+
+def emit_line(prefix, data):
+    """Write one protocol line; the lock keeps concurrent jobs from interleaving."""
+    job_id = getattr(_job_context, 'job_id', None)
+    if job_id is not None:
+        data = {**data, "job": job_id}
+    with _output_lock:
+        print(f"{prefix}:{json.dumps(data)}", flush=True)
+
+def check_cancelled():
+    cancel_event = getattr(_job_context, 'cancel_event', None)
+    if cancel_event is not None and cancel_event.is_set():
+        raise JobCancelled("Job cancelled")
+
+class Telemetry:
+    """Per-job exclusive stage timings (they sum to wall time), counters and progress throttle state."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.walls = {}  # inclusive wall time of spans opened in this process
+        self.counters = {}
+        self._stack = []  # [name, start, child_seconds] for open spans
+        self._lock = threading.Lock()
+        self._last_emit = 0.0
+        self._last_step = None
+        self._last_percent = None
+
+    @contextmanager
+    def span(self, name):
+        entry = [name, time.perf_counter(), 0.0]
+        self._stack.append(entry)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = time.perf_counter() - entry[1]
+            self._add(name, elapsed - entry[2], elapsed)
+            with self._lock:
+                self.walls[name] = self.walls.get(name, 0.0) + elapsed
+
+    def add_time(self, name, seconds):
+        """Record time measured inline (e.g. per-frame compose) as its own stage."""
+        self._add(name, seconds, seconds)
+
+    def _add(self, name, own_seconds, total_seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + own_seconds
+            if self._stack:
+                self._stack[-1][2] += total_seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, snapshot):
+        """Fold in a snapshot from another process (parallel render segments)."""
+        with self._lock:
+            for name, seconds in snapshot['stages'].items():
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+            for name, n in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return {'stages': dict(self.stages), 'counters': dict(self.counters)}
+
+    def should_emit(self, step_name, percent, force=False):
+        """New steps and percentages always go out; repeats at most every PROGRESS_MIN_INTERVAL."""
+        now = time.monotonic()
+        if (force or step_name != self._last_step or percent != self._last_percent
+                or now - self._last_emit >= PROGRESS_MIN_INTERVAL):
+            self._last_step, self._last_percent, self._last_emit = step_name, percent, now
+            return True
+        return False
+
+    def summary(self):
+        snap = self.snapshot()
+        frames = snap['counters'].get('frames', 0)
+        # Wall time, not summed stage time: parallel segments overlap
+        render_s = self.walls.get('render', 0.0)
+        return {
+            'total_s': round(time.perf_counter() - self.started, 3),
+            'stages': {k: round(v, 3) for k, v in snap['stages'].items()},
+            'counters': snap['counters'],
+            'frames_per_s': round(frames / render_s, 2) if render_s > 0 else None,
+        }
+
+def current_telemetry():
+    return getattr(_job_context, 'telemetry', None)
+
+def stage_span(name):
+    telemetry = current_telemetry()
+    return telemetry.span(name) if telemetry else nullcontext()
+
+def telemetry_count(name, n=1):
+    telemetry = current_telemetry()
+    if telemetry: telemetry.count(name, n)
+
+def bind_job_context(fn):
+    """Run fn on a pool thread with the submitting thread's job context (id, cancel flag, telemetry)."""
+    captured = dict(vars(_job_context))
+    def bound(*args, **kwargs):
+        saved = dict(vars(_job_context))
+        vars(_job_context).update(captured)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            vars(_job_context).clear()
+            vars(_job_context).update(saved)
+    return bound
+
+def send_progress(step_name, percent, message="", stage="processing", force=False, **extra):
     """
-    CRITICAL: Triple flush to prevent browser timeout
+    Emit a PROGRESS line (extra kwargs join the payload); repeats of a step's last percentage
+    are throttled, force=True always sends.
     """
+    if stage == "processing":
+        check_cancelled()
+        telemetry = current_telemetry()
+        if telemetry and not telemetry.should_emit(step_name, percent, force):
+            telemetry.count('progress_suppressed')
+            return
     data = {
         "step": step_name,
         "progress": percent,
         "message": message,
         "stage": stage,
-        "timestamp": time.time()
+        "timestamp": time.time(),
+        **extra
     }
-    
-    # Print and flush 3 times for maximum reliability
-    output = f"PROGRESS:{json.dumps(data)}"
-    print(output, flush=True)
-    sys.stdout.flush()
-    sys.stderr.flush()  # Also flush stderr
-    
-    # Small sleep to ensure OS buffer flushes
-    time.sleep(0.001)
+    emit_line("PROGRESS", data)
 
 # ============================================================================
 # HELPER FUNCTIONS
@@ -172,8 +337,27 @@ def compute_bearing(lat1, lon1, lat2, lon2):
         math.sin(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.cos(dLon)
     return (math.degrees(math.atan2(y, x)) + 360) % 360
 
+def haversine_distance_np(lat1, lon1, lat2, lon2):
+    """Vectorized haversine_distance over NumPy arrays (metres)."""
+    R = 6371000.0
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    a = np.sin(dphi/2)**2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda/2)**2
+    return R * 2 * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+def compute_bearing_np(lat1, lon1, lat2, lon2):
+    """Vectorized compute_bearing over NumPy arrays (degrees, 0-360)."""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dLon = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    y = np.sin(dLon) * np.cos(phi2)
+    x = np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(dLon)
+    return (np.degrees(np.arctan2(y, x)) + 360) % 360
+
 def smooth_series(series, window=SMOOTH_WINDOW):
+    import pandas as pd
     if USE_GAUSSIAN_SMOOTHING:
+        from scipy.ndimage import gaussian_filter1d
         return pd.Series(gaussian_filter1d(series, sigma=window/2))
     return series.rolling(window=window, center=True, min_periods=1).mean()
 
@@ -185,6 +369,11 @@ def interpolate_bearing(bearing1, bearing2, t):
     diff = ((bearing2 - bearing1 + 180) % 360) - 180
     return (bearing1 + diff * t) % 360
 
+def interpolate_bearing_np(bearing1, bearing2, t):
+    """Vectorized interpolate_bearing (shortest arc)."""
+    diff = ((bearing2 - bearing1 + 180) % 360) - 180
+    return (bearing1 + diff * t) % 360
+
 def calculate_dynamic_camera(speed_kmh):
     if not DYNAMIC_CAMERA: return CAMERA_ZOOM_BASE, CAMERA_PITCH_BASE
     if speed_kmh < 20:
@@ -208,118 +397,877 @@ def format_time(seconds):
     s = int(seconds % 60)
     return f"{h:02d}:{m:02d}:{s:02d}"
 
+# ============================================================================
+# DISK CACHES
+# ============================================================================
+class DiskCache:
+    """Content-addressed on-disk cache (SHA-1 of the key), written atomically, LRU-evicted past max_bytes."""
+    def __init__(self, cache_dir=MAP_CACHE_DIR, max_bytes=MAP_CACHE_MAX_MB * 1024 * 1024, suffix='.img'):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # digest -> size, least recently used first
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.suffix): continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name[:-len(self.suffix)], st.st_size))
+        for _, digest, size in sorted(entries):
+            self._index[digest] = size
+            self._total_bytes += size
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, digest + self.suffix)
+
+    def get(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        with self._lock:
+            if digest not in self._index:
+                self.misses += 1
+                return None
+            path = self._path(digest)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)  # recency survives restarts via mtime
+            except OSError:
+                self._total_bytes -= self._index.pop(digest)
+                self.misses += 1
+                return None
+            self._index.move_to_end(digest)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(digest))
+        except OSError:
+            try: os.remove(tmp_path)
+            except OSError: pass
+            return
+        with self._lock:
+            self._total_bytes += len(data) - self._index.pop(digest, 0)
+            self._index[digest] = len(data)
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._index:
+            digest, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            try: os.remove(self._path(digest))
+            except OSError: pass
+
+    def __contains__(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        with self._lock:
+            return digest in self._index
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._index), 'bytes': self._total_bytes}
+
+_static_map_cache = None
+
+def get_static_map_cache():
+    global _static_map_cache
+    if _static_map_cache is None:
+        _static_map_cache = DiskCache(MAP_CACHE_DIR, suffix='.img')
+    return _static_map_cache
+
+def static_map_cache_key(lon, lat, zoom, bearing, pitch, size=MAP_IMAGE_SIZE, style=MAP_STYLE):
+    return f"{style}|{lon}|{lat}|{zoom}|{bearing}|{pitch}|{size}"
+
+def quantize_camera(pos):
+    """Round camera params so frames a few centimetres apart share a cache entry."""
+    return (
+        round(float(pos['lon']), MAP_CACHE_COORD_DECIMALS),
+        round(float(pos['lat']), MAP_CACHE_COORD_DECIMALS),
+        round(float(pos['zoom']), 2),
+        int(pos['bearing']),
+        int(pos['pitch']),
+    )
+
+def fetch_static_map(pos, cache=None, session=None):
+    """Return the raw static image bytes for a camera position, or None."""
+    lon, lat, zoom, bearing, pitch = quantize_camera(pos)
+    key = static_map_cache_key(lon, lat, zoom, bearing, pitch)
+    if cache is not None:
+        data = cache.get(key)
+        if data is not None:
+            telemetry_count('map_cache_hits')
+            return data
+        telemetry_count('map_cache_misses')
+
+    style = MAP_STYLE.replace('mapbox://styles/', '')
+    url = f"{MAPBOX_API_BASE}/styles/v1/{style}/static/{lon},{lat},{zoom:g},{bearing},{pitch}/{MAP_IMAGE_SIZE}?access_token={MAPBOX_API_KEY}"
+    resp = (session or get_http_session()).get(url, timeout=5)
+    telemetry_count('map_requests')
+    telemetry_count('bytes_fetched', len(resp.content))
+    if resp.status_code != 200: return None
+    if cache is not None:
+        cache.put(key, resp.content)
+    return resp.content
+
+# ============================================================================
+# BACKGROUND PREFETCH
+# ============================================================================
+_http_session = None
+
+def get_http_session():
+    """Shared keep-alive session with a connection pool sized for the fetch workers."""
+    global _http_session
+    if _http_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        retry = Retry(total=MAP_FETCH_RETRIES, backoff_factor=0.3,
+                      status_forcelist=(429, 500, 502, 503, 504), allowed_methods=('GET',))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAP_FETCH_WORKERS * max(1, WORKER_MAX_JOBS), max_retries=retry)
+        _http_session = requests.Session()
+        _http_session.mount('https://', adapter)
+        _http_session.mount('http://', adapter)
+    return _http_session
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all threads sharing it."""
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second if rate_per_second else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def _fetch_background(pos, cache, session):
+    try:
+        tiles = get_tile_source()
+        if tiles is not None:
+            return render_tile_background(pos, tiles)
+        data = fetch_static_map(pos, cache=cache, session=session)
+        if data is None: return None
+        image = Image.open(BytesIO(data)).convert('RGB').resize((VIDEO_WIDTH, VIDEO_HEIGHT))
+        return np.asarray(image)
+    except Exception:
+        telemetry_count('map_errors')
+        return None
+
+def prefetch_map_backgrounds(camera_positions, frame_indices, cache=None,
+                             workers=MAP_FETCH_WORKERS, ahead=MAP_PREFETCH_AHEAD):
+    """Yield (frame_index, rgb_array_or_None) in order; at most `ahead` downloads/decodes in flight."""
+    session = get_http_session()
+    fetch = bind_job_context(_fetch_background)
+    pending = deque()
+    todo = iter(frame_indices)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='map-fetch')
+    try:
+        for i in todo:
+            pending.append((i, executor.submit(fetch, camera_positions[i], cache, session)))
+            if len(pending) >= ahead: break
+        while pending:
+            i, future = pending.popleft()
+            image = future.result()
+            nxt = next(todo, None)
+            if nxt is not None:
+                pending.append((nxt, executor.submit(fetch, camera_positions[nxt], cache, session)))
+            yield i, image
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+# ============================================================================
+# TILE MOSAIC BACKGROUNDS
+# ============================================================================
+_tile_source = None
+
+def get_tile_source():
+    """The configured TileSource, or None when backgrounds come from the Static Images API."""
+    global _tile_source
+    if not (MAP_TILE_SOURCE or MAP_TILE_URL): return None
+    # Re-opened after a fork: parallel render segments must not share a SQLite handle
+    if _tile_source is None or _tile_source.pid != os.getpid():
+        _tile_source = TileSource(MAP_TILE_SOURCE, MAP_TILE_URL)
+    return _tile_source
+
+class TileSource:
+    """XYZ raster tiles from a directory or MBTiles file, downloading missing ones from url; decoded tiles share an LRU."""
+    EXTENSIONS = ('png', 'jpg', 'jpeg', 'webp')
+
+    def __init__(self, path=None, url=None, memory_tiles=MAP_TILE_MEMORY_TILES):
+        self.pid = os.getpid()
+        self.url = url
+        self.mbtiles = None
+        self.tile_dir = None
+        if path and path.lower().endswith('.mbtiles'):
+            import sqlite3
+            self.mbtiles = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        elif path:
+            self.tile_dir = path
+        self.download_dir = self.tile_dir or MAP_TILE_CACHE_DIR
+        self.memory_tiles = memory_tiles
+        self._tiles = OrderedDict()
+        self._failed = {}  # (z, x, y) -> time of the last failed attempt
+        self._lock = threading.Lock()
+
+    def _read(self, z, x, y):
+        if self.mbtiles is not None:
+            with self._lock:
+                # MBTiles rows are TMS: y counts up from the south
+                row = self.mbtiles.execute(
+                    "SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                    (z, x, (1 << z) - 1 - y)).fetchone()
+            if row: return bytes(row[0])
+        for directory in {self.tile_dir, self.download_dir} - {None}:
+            for ext in self.EXTENSIONS:
+                path = os.path.join(directory, str(z), str(x), f"{y}.{ext}")
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        return f.read()
+        return None
+
+    def _download(self, z, x, y, session=None):
+        url = self.url.format(z=z, x=x, y=y, token=MAPBOX_API_KEY or '')
+        resp = (session or get_http_session()).get(url, timeout=10)
+        telemetry_count('tile_requests')
+        telemetry_count('bytes_fetched', len(resp.content))
+        # Only a definite "no such tile" is a miss; 5xx and the like raise and are retried
+        if resp.status_code in (204, 404): return None
+        resp.raise_for_status()
+        ext = 'jpg' if resp.content[:3] == b'\xff\xd8\xff' else 'png'
+        path = os.path.join(self.download_dir, str(z), str(x), f"{y}.{ext}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(resp.content)
+        os.replace(tmp, path)
+        return resp.content
+
+    def fetch(self, z, x, y, session=None):
+        """
+        Raw tile bytes, local first, then the download URL; None if the
+        sources do not have the tile. Network and server errors raise.
+        """
+        data = self._read(z, x, y)
+        if data is None and self.url:
+            data = self._download(z, x, y, session)
+        return data
+
+    def tile(self, z, x, y):
+        """Decoded RGB tile or None; known-absent tiles are cached, failures retried after MAP_TILE_RETRY_AFTER."""
+        key = (z, x, y)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+            if time.monotonic() - self._failed.get(key, -math.inf) < MAP_TILE_RETRY_AFTER:
+                return None
+        image = None
+        try:
+            data = self.fetch(z, x, y)
+            if data is not None:
+                image = Image.open(BytesIO(data)).convert('RGB')
+                if image.size != (MAP_TILE_SIZE, MAP_TILE_SIZE):
+                    image = image.resize((MAP_TILE_SIZE, MAP_TILE_SIZE))
+                image.load()
+        except Exception:
+            telemetry_count('tile_errors')
+            with self._lock:
+                self._failed[key] = time.monotonic()
+            return None
+        with self._lock:
+            self._failed.pop(key, None)
+            self._tiles[key] = image
+            while len(self._tiles) > self.memory_tiles:
+                self._tiles.popitem(last=False)
+        return image
+
+def lonlat_to_world_px(lon, lat, world_size):
+    """Web Mercator pixel coordinates for a world world_size pixels wide."""
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    x = (lon + 180.0) / 360.0 * world_size
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * world_size
+    return x, y
+
+def tile_bands(pos):
+    """
+    Split a camera view into horizontal bands that each use one tile zoom, as Mapbox GL does.
+    Returns [(row_top, row_bottom, tile_zoom, corners)], corners in world pixels at tile_zoom.
+    """
+    zoom = float(pos['zoom'])
+    view_width = int(MAP_IMAGE_SIZE.split('x')[0])
+    base_zoom = int(np.clip(round(zoom + math.log2(512 / MAP_TILE_SIZE) + math.log2(VIDEO_WIDTH / view_width)),
+                            0, MAP_TILE_MAX_ZOOM))
+    world = MAP_TILE_SIZE * 2 ** base_zoom
+    scale = world / (512 * 2 ** zoom) * view_width / VIDEO_WIDTH  # world px per output px at the centre
+    cx, cy = lonlat_to_world_px(float(pos['lon']), float(pos['lat']), world)
+
+    pitch = math.radians(min(float(pos['pitch']), MAP_TILE_MAX_PITCH))
+    bearing = math.radians(float(pos['bearing']))
+    right = (math.cos(bearing), math.sin(bearing))
+    up = (math.sin(bearing), -math.cos(bearing))
+    distance = MAP_CAMERA_ALTITUDE * VIDEO_HEIGHT
+    height = distance * math.cos(pitch)
+    half_w, half_h = VIDEO_WIDTH / 2, VIDEO_HEIGHT / 2
+
+    def ground(sx, sy):
+        # Screen offset from centre (sy up) -> world px at base_zoom
+        theta = math.atan(sy / distance)
+        ray = pitch + theta  # from straight down
+        forward = height * math.tan(ray) - distance * math.sin(pitch)
+        lateral = sx * height / math.cos(ray) * math.cos(theta) / distance
+        return (cx + scale * (lateral * right[0] + forward * up[0]),
+                cy + scale * (lateral * right[1] + forward * up[1]))
+
+    # Ground per pixel relative to the centre row is cos p / (cos p - sin p tan theta);
+    # band k covers the rows where that is within a factor of two of 2**k
+    rows = [VIDEO_HEIGHT]
+    if pitch > 0:
+        k = 0
+        while rows[-1] > 0 and base_zoom - k > 0:
+            sy = distance / math.tan(pitch) * (1 - 2 ** -(k + 0.5))
+            rows.append(max(0, int(round(half_h - sy))))
+            k += 1
+    if rows[-1] > 0: rows.append(0)
+
+    bands = []
+    for k, (bottom, top) in enumerate(zip(rows, rows[1:])):
+        if bottom <= top: continue
+        shrink = 2 ** k
+        corners = [ground(sx, half_h - row) for sx, row in
+                   ((-half_w, top), (half_w, top), (half_w, bottom), (-half_w, bottom))]
+        bands.append((top, bottom, base_zoom - k, [(x / shrink, y / shrink) for x, y in corners]))
+    return bands
+
+def tile_range(tile_zoom, corners):
+    """Inclusive (x0, x1, y0, y1) tile indices covering the corners; x may wrap."""
+    xs = [c[0] for c in corners]
+    ys = [c[1] for c in corners]
+    last = (1 << tile_zoom) - 1
+    return (math.floor(min(xs) / MAP_TILE_SIZE), math.floor(max(xs) / MAP_TILE_SIZE),
+            max(0, math.floor(min(ys) / MAP_TILE_SIZE)), min(last, math.floor(max(ys) / MAP_TILE_SIZE)))
+
+def perspective_coeffs(dst, src):
+    """PIL PERSPECTIVE data mapping each output corner in dst to its source point in src."""
+    rows, rhs = [], []
+    for (x, y), (u, v) in zip(dst, src):
+        rows.append([x, y, 1, 0, 0, 0, -x * u, -y * u]); rhs.append(u)
+        rows.append([0, 0, 0, x, y, 1, -x * v, -y * v]); rhs.append(v)
+    return tuple(np.linalg.solve(np.array(rows, dtype=float), np.array(rhs, dtype=float)))
+
+def render_tile_background(pos, tiles):
+    """One background at final resolution: each band's tile mosaic warped into place; None without tiles."""
+    size = MAP_TILE_SIZE
+    frame = Image.new('RGB', (VIDEO_WIDTH, VIDEO_HEIGHT), MAP_TILE_FILL)
+    found = 0
+    for top, bottom, tile_zoom, corners in tile_bands(pos):
+        x0, x1, y0, y1 = tile_range(tile_zoom, corners)
+        n = 1 << tile_zoom
+        mosaic = Image.new('RGB', ((x1 - x0 + 1) * size, (y1 - y0 + 1) * size), MAP_TILE_FILL)
+        for ty in range(y0, y1 + 1):
+            for tx in range(x0, x1 + 1):
+                tile = tiles.tile(tile_zoom, tx % n, ty)
+                if tile is None: continue
+                mosaic.paste(tile, ((tx - x0) * size, (ty - y0) * size))
+                found += 1
+        src = [(x - x0 * size, y - y0 * size) for x, y in corners]
+        dst = [(0, 0), (VIDEO_WIDTH, 0), (VIDEO_WIDTH, bottom - top), (0, bottom - top)]
+        band = mosaic.transform((VIDEO_WIDTH, bottom - top), Image.PERSPECTIVE,
+                                perspective_coeffs(dst, src), resample=Image.BILINEAR)
+        frame.paste(band, (0, top))
+    return np.asarray(frame) if found else None
+
+def seed_route_tiles(camera_positions, frame_indices, tiles=None, workers=MAP_FETCH_WORKERS):
+    """Download the tiles the frames need before rendering; returns (tiles_needed, tiles_available)."""
+    tiles = tiles or get_tile_source()
+    needed = set()
+    for i in frame_indices:
+        for _, _, tile_zoom, corners in tile_bands(camera_positions[i]):
+            x0, x1, y0, y1 = tile_range(tile_zoom, corners)
+            n = 1 << tile_zoom
+            needed.update((tile_zoom, tx % n, ty) for tx in range(x0, x1 + 1) for ty in range(y0, y1 + 1))
+    session = get_http_session()
+
+    def fetch(key):
+        try:
+            return tiles.fetch(*key, session=session) is not None
+        except Exception:
+            # Left to the renderer, which retries it
+            telemetry_count('tile_errors')
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tile-seed') as pool:
+        available = sum(pool.map(bind_job_context(fetch), needed))
+    return len(needed), available
+
 # ============================================================================
 # STOP DETECTION
 # ============================================================================
+def project_local_metres(lats, lons):
+    """Equirectangular projection around the route's mean latitude (metres)."""
+    R = 6371000.0
+    lat0 = np.radians(np.mean(lats)) if len(lats) else 0.0
+    return np.column_stack([R * np.radians(lons) * np.cos(lat0), R * np.radians(lats)])
+
+def merge_nearby_stops(lats, lons, radius_m=STOP_MIN_DISTANCE):
+    """Keep-mask: a stop is dropped if an earlier kept stop lies within radius_m."""
+    from scipy.spatial import cKDTree
+    keep = np.zeros(len(lats), dtype=bool)
+    if len(lats) == 0: return keep
+    points = project_local_metres(lats, lons)
+    neighbours = cKDTree(points).query_ball_point(points, r=radius_m)
+    suppressed = np.zeros(len(lats), dtype=bool)
+    for i in range(len(lats)):
+        if suppressed[i]: continue
+        keep[i] = True
+        suppressed[neighbours[i]] = True
+    return keep
+
 def detect_stops(gps_df):
+    import pandas as pd
     send_progress("Stop Detection", 25, "Analyzing route for stops...")
     
     if 'Timestamp' not in gps_df.columns:
-        timestamps = [datetime.now()]
-        for i in range(1, len(gps_df)):
-            if gps_df.loc[i, 'Speed'] > 1:
-                dist_km = (gps_df.loc[i, 'Distance_km'] - gps_df.loc[i-1, 'Distance_km'])
-                time_h = dist_km / max(gps_df.loc[i, 'Speed'], 1)
-                timestamps.append(timestamps[-1] + timedelta(hours=time_h))
-            else:
-                timestamps.append(timestamps[-1] + timedelta(seconds=5))
-        gps_df['Timestamp'] = timestamps
+        # Moving: distance / speed, stationary: fixed 5 s step
+        speed = gps_df['Speed'].to_numpy(dtype=float)
+        step_s = np.full(len(gps_df), 5.0)
+        step_s[0] = 0.0
+        moving = speed[1:] > 1
+        dist_km = np.diff(gps_df['Distance_km'].to_numpy(dtype=float))
+        step_s[1:][moving] = dist_km[moving] / np.maximum(speed[1:][moving], 1) * 3600
+        gps_df['Timestamp'] = pd.Timestamp(datetime.now()) + pd.to_timedelta(np.cumsum(step_s), unit='s')
     
     gps_df['is_stop'] = gps_df['Speed'] <= STOP_SPEED_THRESHOLD
     gps_df['stop_group'] = (gps_df['is_stop'] != gps_df['is_stop'].shift()).cumsum()
     gps_df['time_diff'] = gps_df['Timestamp'].diff().dt.total_seconds().fillna(0)
     
-    stop_durations = gps_df.groupby('stop_group').agg({'is_stop': 'first', 'time_diff': 'sum'}).reset_index()
-    significant_stops = stop_durations[(stop_durations['is_stop'] == True) & (stop_durations['time_diff'] >= STOP_MIN_DURATION)]['stop_group'].tolist()
-    
-    stop_positions = []
-    last_stop_lat, last_stop_lon = None, None
-    
-    for stop_group in significant_stops:
-        stop_points = gps_df[gps_df['stop_group'] == stop_group]
-        if len(stop_points) > 0:
-            mid_idx = stop_points.index[len(stop_points) // 2]
-            stop_lat = gps_df.loc[mid_idx, 'Latitude']
-            stop_lon = gps_df.loc[mid_idx, 'Longitude']
-            if last_stop_lat is not None:
-                dist = haversine_distance(last_stop_lat, last_stop_lon, stop_lat, stop_lon)
-                if dist < STOP_MIN_DISTANCE: continue
-            stop_positions.append(mid_idx)
-            last_stop_lat, last_stop_lon = stop_lat, stop_lon
-            
-    return stop_positions
+    # One pass over the groups: duration plus the first row and length of each run
+    groups = gps_df.assign(_pos=np.arange(len(gps_df))).groupby('stop_group', sort=True).agg(
+        is_stop=('is_stop', 'first'), duration=('time_diff', 'sum'),
+        first=('_pos', 'first'), count=('_pos', 'size'))
+    significant = groups[groups['is_stop'] & (groups['duration'] >= STOP_MIN_DURATION)]
+    mid_pos = (significant['first'] + significant['count'] // 2).to_numpy()
+    
+    keep = merge_nearby_stops(gps_df['Latitude'].to_numpy(dtype=float)[mid_pos],
+                              gps_df['Longitude'].to_numpy(dtype=float)[mid_pos])
+    return gps_df.index[mid_pos[keep]].tolist()
 
 # ============================================================================
 # STREETVIEW PHOTO CAPTURE
 # ============================================================================
-def get_streetview_photo(lat, lon, heading=0, stop_id="stop"):
+_streetview_caches = None
+
+def get_streetview_caches():
+    """(metadata_cache, photo_cache); metadata results include negative ones."""
+    global _streetview_caches
+    if _streetview_caches is None:
+        _streetview_caches = (
+            DiskCache(os.path.join(STREETVIEW_CACHE_DIR, 'metadata'), suffix='.json'),
+            DiskCache(os.path.join(STREETVIEW_CACHE_DIR, 'photos'), suffix='.jpg'),
+        )
+    return _streetview_caches
+
+def get_streetview_photo(lat, lon, heading=0, stop_id="stop", photo_dir=None, session=None, limiter=None):
+    """Street View JPEG for a stop, cached by location; returns (path, True) or (None, False)."""
+    if not GOOGLE_API_KEY: return None, False
+    session = session or get_http_session()
+    metadata_cache, photo_cache = get_streetview_caches()
+    lat, lon, heading = round(float(lat), 5), round(float(lon), 5), int(heading)
+    
     try:
-        if not GOOGLE_API_KEY: return None, False
-        metadata_url = f"https://maps.googleapis.com/maps/api/streetview/metadata?location={lat},{lon}&key={GOOGLE_API_KEY}"
-        if requests.get(metadata_url, timeout=5).json().get('status') == 'OK':
-            photo_url = f"https://maps.googleapis.com/maps/api/streetview?size=600x400&location={lat},{lon}&heading={heading}&fov=90&pitch=10&key={GOOGLE_API_KEY}"
-            response = requests.get(photo_url, timeout=10)
-            if response.status_code == 200:
-                img = Image.open(BytesIO(response.content)).convert("RGB")
-                fname = f"{stop_id}_streetview.jpg"
-                fpath = os.path.join(PHOTO_DIR, fname)
-                img.save(fpath, quality=90)
-                return fpath, True
-    except: pass
-    return None, False
+        location_key = f"{lat},{lon}"
+        cached = metadata_cache.get(location_key)
+        if cached is not None:
+            telemetry_count('streetview_cache_hits')
+            status = json.loads(cached)['status']
+        else:
+            if limiter: limiter.acquire()
+            metadata_url = f"{GOOGLE_API_BASE}/maps/api/streetview/metadata?location={lat},{lon}&key={GOOGLE_API_KEY}"
+            status = session.get(metadata_url, timeout=5).json().get('status')
+            telemetry_count('streetview_requests')
+            # OK and "no imagery" are facts about the place; quota/errors are not cached
+            if status in ('OK', 'ZERO_RESULTS', 'NOT_FOUND'):
+                metadata_cache.put(location_key, json.dumps({'status': status}).encode('utf-8'))
+        if status != 'OK': return None, False
+        
+        photo_key = f"{lat},{lon}|{heading}|{STREETVIEW_SIZE}|90|10"
+        data = photo_cache.get(photo_key)
+        if data is not None:
+            telemetry_count('streetview_cache_hits')
+        else:
+            if limiter: limiter.acquire()
+            photo_url = f"{GOOGLE_API_BASE}/maps/api/streetview?size={STREETVIEW_SIZE}&location={lat},{lon}&heading={heading}&fov=90&pitch=10&key={GOOGLE_API_KEY}"
+            response = session.get(photo_url, timeout=10)
+            telemetry_count('streetview_requests')
+            telemetry_count('bytes_fetched', len(response.content))
+            if response.status_code != 200: return None, False
+            data = response.content
+            photo_cache.put(photo_key, data)
+        
+        fpath = os.path.join(photo_dir or PHOTO_DIR, f"{stop_id}_streetview.jpg")
+        with open(fpath, 'wb') as f:
+            f.write(data)
+        return fpath, True
+    except Exception:
+        return None, False
 
-def capture_stop_photos(gps_df, stop_positions):
-    total_stops = min(len(stop_positions), MAX_STOP_PHOTOS)
+def capture_stop_photos(gps_df, stop_positions, photo_dir=None):
+    """Photos for up to MAX_STOP_PHOTOS stops: {stop_idx: {photo_path, lat, lon, stop_num}}."""
+    stops = stop_positions[:MAX_STOP_PHOTOS]
+    total_stops = len(stops)
     send_progress("Capturing Photos", 30, f"Preparing {total_stops} stop photos...")
     photo_data = {}
+    if not total_stops or not GOOGLE_API_KEY: return photo_data
     
-    for i, stop_idx in enumerate(stop_positions[:MAX_STOP_PHOTOS]):
-        stop_row = gps_df.loc[stop_idx]
-        
-        # Send progress BEFORE API call
-        pct = 30 + int((i / total_stops) * 10)
-        send_progress("Capturing Photos", pct, f"Capturing stop {i+1}/{total_stops}")
-        sys.stdout.flush()
-        
-        fpath, success = get_streetview_photo(
-            stop_row['Latitude'], 
-            stop_row['Longitude'], 
-            heading=stop_row.get('Bearing', 0), 
-            stop_id=f"stop_{i+1}"
+    session = get_http_session()
+    limiter = RateLimiter(STREETVIEW_RATE_LIMIT)
+    lats = gps_df.loc[stops, 'Latitude'].to_numpy(dtype=float)
+    lons = gps_df.loc[stops, 'Longitude'].to_numpy(dtype=float)
+    headings = gps_df.loc[stops, 'Bearing'].to_numpy(dtype=float) if 'Bearing' in gps_df.columns else np.zeros(total_stops)
+    
+    def capture(i):
+        return get_streetview_photo(
+            lats[i], lons[i], heading=headings[i],
+            stop_id=f"stop_{i+1}", photo_dir=photo_dir, session=session, limiter=limiter
         )
-        
-        if success:
-            with open(fpath, "rb") as f:
-                img_base64 = base64.b64encode(f.read()).decode("utf-8")
-            photo_data[stop_idx] = {
-                'photo': f"data:image/jpeg;base64,{img_base64}",
-                'lat': stop_row['Latitude'],
-                'lon': stop_row['Longitude'],
-                'stop_num': i + 1
-            }
+    
+    with ThreadPoolExecutor(max_workers=STREETVIEW_WORKERS, thread_name_prefix='streetview') as pool:
+        for i, (fpath, success) in enumerate(pool.map(bind_job_context(capture), range(total_stops))):
+            pct = 30 + int(((i + 1) / total_stops) * 10)
+            send_progress("Capturing Photos", pct, f"Captured stop {i+1}/{total_stops}")
+            if success:
+                photo_data[stops[i]] = {
+                    'photo_path': fpath,
+                    'lat': float(lats[i]),
+                    'lon': float(lons[i]),
+                    'stop_num': i + 1
+                }
 
     return photo_data
 
 # ============================================================================
 # MAP MATCHING
 # ============================================================================
-def mapbox_map_matching(coordinates):
-    if len(coordinates) > 100 or not MAPBOX_API_KEY: return coordinates
-    coords_str = ';'.join([f"{lon},{lat}" for lon, lat in coordinates])
-    url = f"https://api.mapbox.com/matching/v5/mapbox/{MAP_MATCHING_PROFILE}/{coords_str}"
-    params = {'access_token': MAPBOX_API_KEY, 'geometries': 'geojson', 'overview': 'full', 'tidy': 'true'}
+_map_matching_cache = None
+
+def get_map_matching_cache():
+    global _map_matching_cache
+    if _map_matching_cache is None:
+        _map_matching_cache = DiskCache(MAP_MATCHING_CACHE_DIR, suffix='.json')
+    return _map_matching_cache
+
+def mapbox_map_matching(coordinates, session=None, cache=None, limiter=None):
+    """Snap up to MAP_MATCHING_BATCH_SIZE [lon, lat] points; one [lon, lat] or None per input, None on failure."""
+    if len(coordinates) > MAP_MATCHING_BATCH_SIZE:
+        raise ValueError(f"Map matching takes at most {MAP_MATCHING_BATCH_SIZE} coordinates per request")
+    coords_str = ';'.join([f"{lon:.6f},{lat:.6f}" for lon, lat in coordinates])
+    key = f"{MAP_MATCHING_PROFILE}|{MAP_MATCHING_RADIUS}|{coords_str}"
+    if cache is not None:
+        data = cache.get(key)
+        if data is not None:
+            telemetry_count('matching_cache_hits')
+            return json.loads(data)
+
+    if limiter is not None:
+        limiter.acquire()  # only uncached requests count against the rate limit
+    url = f"{MAPBOX_API_BASE}/matching/v5/mapbox/{MAP_MATCHING_PROFILE}/{coords_str}"
+    # tidy=false keeps tracepoints aligned 1:1 with the input coordinates
+    params = {'access_token': MAPBOX_API_KEY, 'geometries': 'geojson', 'overview': 'false',
+              'tidy': 'false', 'radiuses': ';'.join([str(MAP_MATCHING_RADIUS)] * len(coordinates))}
     try:
-        resp = requests.get(url, params=params, timeout=15).json()
-        if 'matchings' in resp: return resp['matchings'][0]['geometry']['coordinates']
-    except: pass
-    return coordinates
+        resp = (session or get_http_session()).get(url, params=params, timeout=15)
+        telemetry_count('matching_requests')
+        telemetry_count('bytes_fetched', len(resp.content))
+        if resp.status_code != 200: return None
+        body = resp.json()
+    except Exception:
+        return None
+    if body.get('code') != 'Ok' or len(body.get('tracepoints', [])) != len(coordinates):
+        return None
+
+    matched = [tp['location'] if tp else None for tp in body['tracepoints']]
+    if cache is not None:
+        cache.put(key, json.dumps(matched).encode('utf-8'))
+    return matched
+
+def map_matching_windows(n_points, batch_size=MAP_MATCHING_BATCH_SIZE, overlap=MAP_MATCHING_OVERLAP):
+    """
+    Overlapping request windows over [0, n_points), each owning up to the middle of its overlap.
+    Returns [(start, stop, own_start, own_stop)].
+    """
+    step = max(1, batch_size - overlap)
+    starts = list(range(0, max(1, n_points - overlap), step))
+    windows = []
+    for k, start in enumerate(starts):
+        stop = min(start + batch_size, n_points)
+        own_start = 0 if k == 0 else windows[-1][3]
+        own_stop = n_points if k == len(starts) - 1 else (starts[k + 1] + stop) // 2
+        windows.append((start, stop, own_start, own_stop))
+    return windows
+
+def map_match_route(lats, lons, on_batch=None):
+    """Map-match a whole route in concurrent cached windows; returns (lats, lons, matched_count)."""
+    windows = map_matching_windows(len(lats))
+    session = get_http_session()
+    cache = get_map_matching_cache()
+    limiter = RateLimiter(MAP_MATCHING_RATE_LIMIT)
+    coords = np.column_stack([lons, lats])
+
+    def match_window(window):
+        start, stop = window[0], window[1]
+        if stop - start < 2: return None
+        return mapbox_map_matching(coords[start:stop].tolist(), session=session, cache=cache, limiter=limiter)
+
+    out_lats, out_lons = lats.copy(), lons.copy()
+    matched_count = 0
+    with ThreadPoolExecutor(max_workers=MAP_MATCHING_WORKERS, thread_name_prefix='map-match') as pool:
+        for done, (window, matched) in enumerate(zip(windows, pool.map(bind_job_context(match_window), windows))):
+            if on_batch: on_batch(done + 1, len(windows))
+            if matched is None: continue
+            start, _, own_start, own_stop = window
+            for i in range(own_start, own_stop):
+                location = matched[i - start]
+                if location is None: continue
+                out_lons[i], out_lats[i] = location
+                matched_count += 1
+    return out_lats, out_lons, matched_count
+
+# ============================================================================
+# TRIP LOADING
+# ============================================================================
+TRIP_FORMATS = {
+    '.xlsx': 'excel', '.xls': 'excel', '.csv': 'csv', '.txt': 'csv',
+    '.parquet': 'parquet', '.gpx': 'gpx', '.nmea': 'nmea', '.log': 'nmea',
+}
+
+def detect_trip_format(path):
+    """Format from the extension, confirmed by sniffing text files (GPX/NMEA saved as .txt etc.)."""
+    fmt = TRIP_FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt in ('excel', 'parquet'): return fmt
+    with open(path, 'rb') as f:
+        head = f.read(512).lstrip()
+    if head.startswith(b'<?xml') or b'<gpx' in head: return 'gpx'
+    if head.startswith(b'$'): return 'nmea'
+    if fmt is None and head.startswith(b'PK'): return 'excel'
+    return fmt or 'csv'
+
+def pick_trip_columns(columns):
+    """Map source column names to Latitude/Longitude/Speed/Timestamp."""
+    col_map = {str(c).lower(): c for c in columns}
+    lat_col = next((c for c in col_map if 'lat' in c), None)
+    lon_col = next((c for c in col_map if 'lon' in c or 'lng' in c), None)
+    if not lat_col or not lon_col:
+        raise ValueError("Could not find latitude/longitude columns in data")
+    picked = {col_map[lat_col]: 'Latitude', col_map[lon_col]: 'Longitude'}
+    speed_col = next((c for c in col_map if 'speed' in c), None)
+    if speed_col and col_map[speed_col] not in picked: picked[col_map[speed_col]] = 'Speed'
+    time_cols = [c for c in col_map if ('time' in c or 'date' in c) and col_map[c] not in picked]
+    full_col = next((c for c in time_cols if 'stamp' in c or 'datetime' in c), None)
+    date_col = next((c for c in time_cols if 'time' not in c), None)
+    clock_col = next((c for c in time_cols if 'date' not in c), None)
+    if full_col:
+        picked[col_map[full_col]] = 'Timestamp'
+    elif date_col and clock_col:
+        # Spreadsheets often split Date and Time; _clean_trip joins them
+        picked[col_map[date_col]] = 'Date'
+        picked[col_map[clock_col]] = 'Time'
+    elif time_cols:
+        picked[col_map[time_cols[0]]] = 'Timestamp'
+    return picked
+
+def _read_tabular(path, fmt):
+    import pandas as pd
+    if fmt == 'csv':
+        picked = pick_trip_columns(pd.read_csv(path, nrows=0).columns)
+        dtypes = {src: 'float64' for src, dst in picked.items() if dst in ('Latitude', 'Longitude', 'Speed')}
+        chunks = pd.read_csv(path, usecols=list(picked), dtype=dtypes, chunksize=CSV_CHUNK_ROWS)
+        df = pd.concat(chunks, ignore_index=True)
+    elif fmt == 'parquet':
+        import pyarrow.parquet as pq
+        picked = pick_trip_columns(pq.read_schema(path).names)
+        df = pd.read_parquet(path, columns=list(picked))
+    else:
+        picked = pick_trip_columns(pd.read_excel(path, nrows=0).columns)
+        df = pd.read_excel(path, usecols=lambda c: c in picked)
+    return df.rename(columns=picked)
+
+def _read_gpx(path):
+    import pandas as pd
+    import xml.etree.ElementTree as ET
+    rows = []
+    # Streamed: each trkpt is dropped as soon as it has been read
+    for _, elem in ET.iterparse(path, events=('end',)):
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if tag not in ('trkpt', 'rtept'): continue
+        row = {'Latitude': float(elem.get('lat')), 'Longitude': float(elem.get('lon'))}
+        for child in elem.iter():
+            child_tag = child.tag.rsplit('}', 1)[-1]
+            if child_tag == 'time' and child.text:
+                row['Timestamp'] = child.text.strip()
+            elif child_tag == 'speed' and child.text:
+                row['Speed'] = float(child.text) * 3.6  # GPX speed is m/s
+        rows.append(row)
+        elem.clear()
+    return pd.DataFrame(rows)
+
+def _nmea_coord(value, hemisphere):
+    if not value: return None
+    dot = value.index('.') if '.' in value else len(value)
+    degrees = float(value[:dot - 2]) + float(value[dot - 2:]) / 60.0
+    return -degrees if hemisphere in ('S', 'W') else degrees
+
+def _read_nmea(path):
+    """RMC sentences (position, speed, time); GGA positions only if there is no RMC."""
+    import pandas as pd
+    rmc, gga = [], []
+    with open(path, 'r', errors='ignore') as f:
+        for line in f:
+            fields = line.strip().split('*')[0].split(',')
+            kind = fields[0][3:] if fields[0].startswith('$') else ''
+            try:
+                if kind == 'RMC' and len(fields) > 9 and fields[2] == 'A':
+                    hhmmss, ddmmyy = fields[1], fields[9]
+                    stamp = None
+                    if len(ddmmyy) == 6 and len(hhmmss) >= 6:
+                        century = 1900 if int(ddmmyy[4:6]) >= 80 else 2000
+                        stamp = f"{century + int(ddmmyy[4:6])}-{ddmmyy[2:4]}-{ddmmyy[0:2]} {hhmmss[0:2]}:{hhmmss[2:4]}:{hhmmss[4:]}"
+                    rmc.append((_nmea_coord(fields[3], fields[4]), _nmea_coord(fields[5], fields[6]),
+                                float(fields[7] or 0) * 1.852, stamp))
+                elif kind == 'GGA' and len(fields) > 6 and fields[6] not in ('', '0'):
+                    gga.append((_nmea_coord(fields[2], fields[3]), _nmea_coord(fields[4], fields[5])))
+            except (ValueError, IndexError):
+                continue  # corrupt sentence
+    if rmc:
+        return pd.DataFrame(rmc, columns=['Latitude', 'Longitude', 'Speed', 'Timestamp'])
+    return pd.DataFrame(gga, columns=['Latitude', 'Longitude'])
+
+def _parse_timestamps(values):
+    """Naive UTC datetimes; numbers are seconds (elapsed or epoch), or epoch milliseconds."""
+    import pandas as pd
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        unit = 'ms' if values.abs().median() > 1e11 else 's'
+        return pd.to_datetime(values, unit=unit, errors='coerce')
+    # Normalized to naive UTC so mixed/zoned sources (GPX 'Z' times) compare cleanly
+    return pd.to_datetime(values, errors='coerce', utc=True).dt.tz_localize(None)
+
+def _join_date_time(dates, clock):
+    import pandas as pd
+    days = _parse_timestamps(dates).dt.normalize()
+    if pd.api.types.is_datetime64_any_dtype(clock):
+        offset = clock - clock.dt.normalize()
+    elif pd.api.types.is_numeric_dtype(clock):
+        offset = pd.to_timedelta(clock, unit='s', errors='coerce')
+    else:
+        offset = pd.to_timedelta(clock.astype(str), errors='coerce')
+    return days + offset
+
+def _clean_trip(df):
+    import pandas as pd
+    df = df.dropna(subset=['Latitude', 'Longitude']).reset_index(drop=True)
+    df['Latitude'] = df['Latitude'].astype(float)
+    df['Longitude'] = df['Longitude'].astype(float)
+    if 'Speed' in df.columns:
+        df['Speed'] = pd.to_numeric(df['Speed'], errors='coerce').interpolate().fillna(0.0)
+    if 'Date' in df.columns:
+        df['Timestamp'] = _join_date_time(df.pop('Date'), df.pop('Time'))
+    if 'Timestamp' in df.columns:
+        stamps = _parse_timestamps(df['Timestamp'])
+        steps = stamps.diff().iloc[1:]
+        # Partial, out-of-order or mostly repeated (date-only) timestamps would
+        # corrupt stop durations; synthesize instead
+        if stamps.isna().any() or (steps < pd.Timedelta(0)).any() or (steps > pd.Timedelta(0)).mean() < 0.5:
+            df = df.drop(columns=['Timestamp'])
+        else:
+            df['Timestamp'] = stamps
+    return df
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def write_frame_npz(df, f):
+    """Store a DataFrame of numeric/datetime columns as a NumPy archive (no pickling)."""
+    arrays = {name: df[name].to_numpy() for name in df.columns}
+    if 'Timestamp' in arrays:
+        arrays['Timestamp'] = arrays['Timestamp'].astype('datetime64[ns]')
+    np.savez(f, **arrays)
+
+def read_frame_npz(f):
+    import pandas as pd
+    with np.load(f) as archive:
+        df = pd.DataFrame({name: archive[name] for name in archive.files})
+    if 'Timestamp' in df.columns:
+        df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+    return df
+
+def load_trip(path, use_cache=True):
+    """
+    Load a trip (Excel, CSV, Parquet, GPX or NMEA) as Latitude/Longitude[/Speed/Timestamp],
+    cached as a NumPy archive by the file's content hash.
+    """
+    cache_path = None
+    if use_cache:
+        os.makedirs(TRIP_CACHE_DIR, exist_ok=True)
+        cache_path = os.path.join(TRIP_CACHE_DIR, f"{file_sha1(path)}-v{TRIP_CACHE_VERSION}.npz")
+        if os.path.exists(cache_path):
+            return read_frame_npz(cache_path)
+
+    fmt = detect_trip_format(path)
+    if fmt == 'gpx':
+        df = _read_gpx(path)
+    elif fmt == 'nmea':
+        df = _read_nmea(path)
+    else:
+        df = _read_tabular(path, fmt)
+    if 'Latitude' not in df.columns:
+        raise ValueError("Could not find latitude/longitude columns in data")
+    df = _clean_trip(df)
+
+    if cache_path:
+        fd, tmp_path = tempfile.mkstemp(dir=TRIP_CACHE_DIR, suffix='.npz')
+        with os.fdopen(fd, 'wb') as f:
+            write_frame_npz(df, f)
+        os.replace(tmp_path, cache_path)
+    return df
 
 # ============================================================================
 # GPS DATA PROCESSING (OPTIMIZED)
 # ============================================================================
 def process_gps_data(gps_df):
+    import pandas as pd
     send_progress("Loading Data", 5, "Processing GPS coordinates...")
     
+    # Positional arrays below assume a 0..n-1 index (dropna leaves gaps)
+    gps_df = gps_df.reset_index(drop=True)
+    lats = gps_df['Latitude'].to_numpy(dtype=float)
+    lons = gps_df['Longitude'].to_numpy(dtype=float)
+    
+    # Segment lengths between consecutive points (metres), shared by all steps
+    seg_dist = haversine_distance_np(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    
     # 1. Speed calculation
     if 'Speed' not in gps_df.columns:
         gps_df['Speed'] = 0.0
@@ -327,222 +1275,1016 @@ def process_gps_data(gps_df):
         gps_df['Speed'] = gps_df['Speed'].astype(float)
 
     if gps_df['Speed'].max() == 0:
-        for i in range(1, len(gps_df)):
-            dist = haversine_distance(
-                gps_df.loc[i-1, 'Latitude'], gps_df.loc[i-1, 'Longitude'],
-                gps_df.loc[i, 'Latitude'], gps_df.loc[i, 'Longitude']
-            )
-            gps_df.loc[i, 'Speed'] = float((dist/5.0 * 3.6) if dist < 500 else 0.0)
+        fallback_speed = np.zeros(len(gps_df))
+        fallback_speed[1:] = np.where(seg_dist < 500, seg_dist / 5.0 * 3.6, 0.0)
+        gps_df['Speed'] = fallback_speed
 
     gps_df['Speed'] = smooth_series(gps_df['Speed'])
-    send_progress("Loading Data", 10, "Speed calculation complete")
+    send_progress("Loading Data", 10, "Speed calculation complete", force=True)
     
-    # 2. Map Matching (HYPER-OPTIMIZED with micro-updates)
-    if USE_MAP_MATCHING and MAPBOX_API_KEY:
+    # 2. Map Matching: snapped positions are written back into the route
+    if USE_MAP_MATCHING and MAPBOX_API_KEY and len(gps_df) > 1:
         send_progress("Map Matching", 15, "Aligning route to roads...")
-        all_matched = []
         
-        # ULTRA-SMALL BATCHES for constant stream
-        batch_size = 20  # Reduced from 30
-        batches = [gps_df.iloc[i:i+batch_size] for i in range(0, len(gps_df), batch_size)]
+        def on_batch(done, total):
+            pct = 15 + int((done / total) * 10)
+            send_progress("Map Matching", pct, f"Batch {done}/{total} matched")
         
-        for i, batch in enumerate(batches):
-            coords = [[row['Longitude'], row['Latitude']] for _, row in batch.iterrows()]
-            
-            # CRITICAL: Update BEFORE and AFTER each API call
-            pct = 15 + int((i / len(batches)) * 10)
-            send_progress("Map Matching", pct, f"Batch {i+1}/{len(batches)} - requesting...")
-            
-            matched = mapbox_map_matching(coords)
-            all_matched.extend(matched)
-            
-            # Immediate confirmation after API returns
-            send_progress("Map Matching", pct, f"Batch {i+1}/{len(batches)} - received ✓")
+        with stage_span('map_matching'):
+            lats, lons, matched_count = map_match_route(lats, lons, on_batch=on_batch)
+        gps_df['Latitude'] = lats
+        gps_df['Longitude'] = lons
+        seg_dist = haversine_distance_np(lats[:-1], lons[:-1], lats[1:], lons[1:])
 
-        send_progress("Map Matching", 25, "Route alignment complete")
+        send_progress("Map Matching", 25, f"Route alignment complete ({matched_count}/{len(gps_df)} points matched)", force=True)
 
     # 3. Bearings & Distance
     send_progress("Map Matching", 26, "Calculating bearings...")
-    bearings, distances, times = [], [0.0], [0.0]
-    for i in range(len(gps_df) - 1):
-        bearings.append(compute_bearing(
-            gps_df.loc[i, 'Latitude'], gps_df.loc[i, 'Longitude'],
-            gps_df.loc[i+1, 'Latitude'], gps_df.loc[i+1, 'Longitude']
-        ))
-        dist = haversine_distance(
-            gps_df.loc[i, 'Latitude'], gps_df.loc[i, 'Longitude'],
-            gps_df.loc[i+1, 'Latitude'], gps_df.loc[i+1, 'Longitude']
-        )
-        distances.append(distances[-1] + dist)
-        
-    bearings.append(bearings[-1] if bearings else 0)
+    bearings = compute_bearing_np(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    bearings = np.append(bearings, bearings[-1] if len(bearings) else 0.0)
+    distances = np.concatenate(([0.0], np.cumsum(seg_dist)))
+    
     gps_df['Bearing'] = smooth_series(pd.Series(bearings))
-    gps_df['Distance_km'] = [d / 1000.0 for d in distances]
+    gps_df['Distance_km'] = distances / 1000.0
     
     send_progress("Map Matching", 28, "Calculating timestamps...")
     
-    # 4. Time calculation
-    for i in range(1, len(gps_df)):
-        speed_val = gps_df.loc[i, 'Speed']
-        if speed_val > 1:
-            time_s = ((distances[i] - distances[i-1]) / (speed_val / 3.6))
-            times.append(times[-1] + time_s)
-        else:
-            times.append(times[-1] + 2)
-    gps_df['Time_seconds'] = times
+    # 4. Time calculation (moving: dist / speed, stationary: fixed 2 s step)
+    speeds = gps_df['Speed'].to_numpy(dtype=float)[1:]
+    moving = speeds > 1
+    step_s = np.full(len(speeds), 2.0)
+    step_s[moving] = seg_dist[moving] / (speeds[moving] / 3.6)
+    gps_df['Time_seconds'] = np.concatenate(([0.0], np.cumsum(step_s)))
     
-    send_progress("Map Matching", 30, "GPS processing complete")
+    send_progress("Map Matching", 30, "GPS processing complete", force=True)
     
     return gps_df
 
 # ============================================================================
 # FRAME GENERATION
 # ============================================================================
+# One record per rendered frame; rows index like the old per-frame dicts
+# (pos['lat'], pos['speed'], ...) so the renderer is agnostic to the storage.
+CAMERA_PATH_DTYPE = np.dtype([
+    ('lat', 'f8'), ('lon', 'f8'), ('bearing', 'f8'),
+    ('speed', 'f8'), ('zoom', 'f4'), ('pitch', 'f4'),
+    ('distance_km', 'f8'), ('time_seconds', 'f8'),
+    ('idx', 'i8'),
+])
+
+def simplify_route(xy, tolerance_m, keep=(), max_points=None):
+    """
+    RDP over projected points (metres), worst span split first so it can stop at max_points.
+    Returns sorted surviving indices; the ends and `keep` always survive.
+    """
+    n = len(xy)
+    if n <= 2: return np.arange(n)
+    anchors = np.unique(np.concatenate(([0, n - 1], np.asarray(keep, dtype=np.int64))))
+    if max_points is not None and len(anchors) > max_points:
+        anchors = np.array([0, n - 1])
+    kept = list(anchors)
+    heap = []
+
+    def push(a, b):
+        if b - a < 2: return
+        inner = xy[a + 1:b] - xy[a]
+        chord = xy[b] - xy[a]
+        length = math.hypot(*chord)
+        if length > 0:
+            dist = np.abs(inner[:, 0] * chord[1] - inner[:, 1] * chord[0]) / length
+        else:
+            dist = np.hypot(inner[:, 0], inner[:, 1])
+        k = int(np.argmax(dist))
+        heapq.heappush(heap, (-dist[k], a, b, a + 1 + k))
+
+    for a, b in zip(anchors[:-1], anchors[1:]):
+        push(a, b)
+    while heap and (max_points is None or len(kept) < max_points):
+        neg_dist, a, b, m = heapq.heappop(heap)
+        if -neg_dist <= tolerance_m: break
+        kept.append(m)
+        push(a, m)
+        push(m, b)
+    return np.sort(np.array(kept, dtype=np.int64))
+
+def allocate_frames(weights, budget, lo=MIN_FRAMES_PER_SEGMENT, hi=MAX_FRAMES_PER_SEGMENT):
+    """Integer frames per segment proportional to weights, each in [lo, hi], summing to budget."""
+    weights = np.asarray(weights, dtype=float)
+    budget = int(min(max(budget, lo * len(weights)), hi * len(weights)))
+    low, high = 0.0, hi / max(weights.min(), 1e-9)
+    for _ in range(60):
+        scale = (low + high) / 2
+        if np.clip(weights * scale, lo, hi).sum() < budget: low = scale
+        else: high = scale
+    exact = np.clip(weights * high, lo, hi)
+    frames = np.floor(exact).astype(np.int64)
+    remainder = budget - int(frames.sum())
+    while remainder > 0:
+        room = np.flatnonzero(frames < hi)
+        pick = room[np.argsort(frames[room] - exact[room], kind='stable')[:remainder]]
+        frames[pick] += 1
+        remainder -= len(pick)
+    return frames
+
+def budgeted_frame_samples(lats, lons, speeds, steps, budget):
+    """
+    Adaptive camera path: simplify the route and share the frame budget by length, turns, speed
+    changes and stops. Returns frame lats, lons and their (raw segment, fraction) on the track.
+    """
+    xy = project_local_metres(lats, lons)
+    # Raw-track parameter in 5 m steps; stationary samples still advance it
+    track = np.concatenate(([0.0], np.cumsum(steps, dtype=float)))
+    stopped = speeds <= STOP_SPEED_THRESHOLD
+    stop_edges = np.flatnonzero(stopped[1:] != stopped[:-1])
+    keep = np.concatenate((stop_edges, stop_edges + 1))
+    
+    # Aim for the middle of the per-segment bounds; the vertex cap keeps the
+    # unit count low enough that every unit can get MIN frames
+    target_units = math.ceil(2 * budget / (MIN_FRAMES_PER_SEGMENT + MAX_FRAMES_PER_SEGMENT))
+    max_units = max(target_units + 1, budget // MIN_FRAMES_PER_SEGMENT)
+    vertices = simplify_route(xy, SIMPLIFY_TOLERANCE_M, keep, max_points=max_units - target_units + 1)
+    seg_len = np.hypot(*np.diff(xy[vertices], axis=0).T)
+    seg_track = np.diff(track[vertices])
+    # Cut segments into pieces of at most unit_len metres and unit_track steps, so
+    # no stretch (or long stop) is capped at MAX frames
+    unit_len = max(seg_len.sum(), 1e-9) / target_units
+    unit_track = track[-1] / target_units
+    pieces = np.maximum(1, np.ceil(np.maximum(seg_len / unit_len, seg_track / unit_track) - 1e-9).astype(np.int64))
+    
+    # One row per unit: its segment and the [s0, s1] span of it
+    seg = np.repeat(np.arange(len(pieces)), pieces)
+    k = np.arange(len(seg)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    s0, s1 = k / pieces[seg], (k + 1) / pieces[seg]
+    a, b = vertices[seg], vertices[seg + 1]
+    
+    headings = np.degrees(np.arctan2(*np.diff(xy[vertices], axis=0).T[::-1]))
+    turn = np.zeros(len(vertices))
+    turn[1:-1] = np.abs((np.diff(headings) + 180) % 360 - 180) * ((seg_len[:-1] > 0) & (seg_len[1:] > 0))
+    unit_turn = np.where(k == 0, turn[seg], 0) + np.where(k == pieces[seg] - 1, turn[seg + 1], 0)
+    track_a = track[a] + s0 * (track[b] - track[a])
+    track_b = track[a] + s1 * (track[b] - track[a])
+    speed_change = np.abs(np.interp(track_b, track, speeds) - np.interp(track_a, track, speeds))
+    weights = (seg_len[seg] / pieces[seg] / max(unit_len, 1e-9)
+               + FRAME_WEIGHT_TURN * unit_turn / 90
+               + FRAME_WEIGHT_SPEED_CHANGE * speed_change / 10
+               + FRAME_WEIGHT_STOP * (stopped[a] & stopped[b]))
+    frames = allocate_frames(weights, budget)
+    
+    unit = np.repeat(np.arange(len(frames)), frames)
+    t = (np.arange(len(unit)) - np.repeat(np.cumsum(frames) - frames, frames)) / frames[unit]
+    s = s0[unit] + (s1[unit] - s0[unit]) * t
+    va, vb = a[unit], b[unit]
+    frame_lats = lats[va] + (lats[vb] - lats[va]) * s
+    frame_lons = lons[va] + (lons[vb] - lons[va]) * s
+    
+    p = track_a[unit] + (track_b[unit] - track_a[unit]) * t
+    raw_seg = np.clip(np.searchsorted(track, p, side='right') - 1, 0, len(steps) - 1)
+    raw_t = np.clip((p - track[raw_seg]) / steps[raw_seg], 0.0, 1.0)
+    return frame_lats, frame_lons, raw_seg, raw_t
+
 def generate_adaptive_frames(gps_df):
     send_progress("Frame Generation", 40, "Calculating camera path...")
     
     target_frames = int(TARGET_VIDEO_DURATION_MINUTES * 60 * VIDEO_FPS)
-    positions = []
     
-    # Linear interpolation for simplicity
-    for i in range(len(gps_df) - 1):
-        row1, row2 = gps_df.iloc[i], gps_df.iloc[i+1]
-        steps = max(1, int((row2['Distance_km'] - row1['Distance_km']) * 1000 / 5))
+    lats = gps_df['Latitude'].to_numpy(dtype=float)
+    lons = gps_df['Longitude'].to_numpy(dtype=float)
+    bearings = gps_df['Bearing'].to_numpy(dtype=float)
+    speeds = gps_df['Speed'].to_numpy(dtype=float)
+    dist_km = gps_df['Distance_km'].to_numpy(dtype=float)
+    times = gps_df['Time_seconds'].to_numpy(dtype=float)
+    
+    # One interpolation step per 5 m of each segment (at least one per segment)
+    steps = np.maximum(1, (np.diff(dist_km) * 1000 / 5).astype(np.int64))
+    seg_end = np.cumsum(steps)
+    total_steps = int(seg_end[-1]) if len(seg_end) else 0
+    
+    if ADAPTIVE_SAMPLING and total_steps > 0:
+        # Same length as the uniform path, spent where the route is interesting
+        frame_lats, frame_lons, seg, t = budgeted_frame_samples(lats, lons, speeds, steps, min(total_steps, target_frames))
+    else:
+        # Resample to target fps: pick the sample indices first, so the full
+        # 5 m-step path is never materialized
+        if total_steps > target_frames:
+            sample = np.linspace(0, total_steps - 1, target_frames).astype(np.int64)
+        else:
+            sample = np.arange(total_steps, dtype=np.int64)
         
-        for t in np.linspace(0, 1, steps, endpoint=False):
-            lat = row1['Latitude'] + (row2['Latitude'] - row1['Latitude']) * t
-            lon = row1['Longitude'] + (row2['Longitude'] - row1['Longitude']) * t
-            bearing = interpolate_bearing(row1['Bearing'], row2['Bearing'], t)
-            
-            positions.append({
-                'lat': lat, 'lon': lon, 'bearing': bearing,
-                'speed': row1['Speed'], 'zoom': 17, 'pitch': 60,
-                'distance_km': row1['Distance_km'], 
-                'time_seconds': row1['Time_seconds'],
-                'idx': i
-            })
-
-    # Resample to target fps
-    if len(positions) > target_frames:
-        indices = np.linspace(0, len(positions)-1, target_frames).astype(int)
-        positions = [positions[i] for i in indices]
-
-    send_progress("Frame Generation", 50, f"Generated {len(positions)} frames")
+        seg = np.searchsorted(seg_end, sample, side='right')
+        t = (sample - (seg_end[seg] - steps[seg])) / steps[seg]
+        frame_lats = lats[seg] + (lats[seg + 1] - lats[seg]) * t
+        frame_lons = lons[seg] + (lons[seg + 1] - lons[seg]) * t
+    
+    positions = np.empty(len(seg), dtype=CAMERA_PATH_DTYPE)
+    positions['lat'] = frame_lats
+    positions['lon'] = frame_lons
+    positions['bearing'] = interpolate_bearing_np(bearings[seg], bearings[seg + 1], t)
+    positions['speed'] = speeds[seg]
+    positions['zoom'] = 17
+    positions['pitch'] = 60
+    positions['distance_km'] = dist_km[seg]
+    positions['time_seconds'] = times[seg]
+    positions['idx'] = seg
+
+    send_progress("Frame Generation", 50, f"Generated {len(positions)} frames", force=True)
     return positions
 
 # ============================================================================
-# VIDEO RENDERING (OPTIMIZED PROGRESS)
+# HUD OVERLAY
 # ============================================================================
-def render_video_static_fallback(camera_positions, gps_df, photo_data, output_path):
-    send_progress("Rendering video", 55, "Starting rendering engine...")
-    
-    frames = []
-    last_frame = None
-    
+HUD_SPEED_POS, HUD_SPEED_COLOR = (50, 50), (0, 255, 136)
+HUD_DISTANCE_POS, HUD_DISTANCE_COLOR = (50, 150), (255, 255, 255)
+HUD_LABEL_CACHE_SIZE = 2048
+
+def load_hud_fonts():
     try:
         font_huge = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 70)
         font_large = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 40)
     except:
         font_huge = font_large = ImageFont.load_default()
+    return font_huge, font_large
+
+def alpha_blend(frame, alpha, color, x, y):
+    """
+    Blend a solid colour through an 8-bit alpha mask into frame (HxWx3 uint8)
+    in place, with its top-left corner at (x, y). Clipped to the frame.
+    """
+    h, w = alpha.shape
+    fh, fw = frame.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, fw), min(y + h, fh)
+    if x0 >= x1 or y0 >= y1: return
+    a = alpha[y0 - y:y1 - y, x0 - x:x1 - x, None].astype(np.uint16)
+    region = frame[y0:y1, x0:x1]
+    blended = (region * (255 - a) + np.asarray(color, dtype=np.uint16) * a + 127) // 255
+    region[...] = blended.astype(np.uint8)
+
+class GlyphAtlas:
+    """Pre-rasterized glyph masks; HUD labels are assembled from them once per distinct value."""
+    def __init__(self, font, charset="0123456789.-: ", tokens=("km/h", "km")):
+        self.font = font
+        self.tokens = sorted(tokens, key=len, reverse=True)
+        self.glyphs = {}
+        for glyph in list(charset) + list(tokens):
+            self.glyphs[glyph] = self._rasterize(glyph)
+        self._labels = OrderedDict()
+        self._lock = threading.Lock()  # atlases are shared by concurrent worker jobs
+
+    def _rasterize(self, text):
+        left, top, right, bottom = self.font.getbbox(text)
+        mask = Image.new('L', (max(1, right - left), max(1, bottom - top)), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, font=self.font, fill=255)
+        return np.asarray(mask), left, top, self.font.getlength(text)
+
+    def _split(self, text):
+        i = 0
+        while i < len(text):
+            token = next((t for t in self.tokens if text.startswith(t, i)), text[i])
+            if token not in self.glyphs:
+                self.glyphs[token] = self._rasterize(token)
+            yield self.glyphs[token]
+            i += len(token)
+
+    def label(self, text):
+        """Return (alpha_mask, dx, dy): the label strip and its offset from the text origin."""
+        with self._lock:
+            return self._label(text)
 
+    def _label(self, text):
+        cached = self._labels.get(text)
+        if cached is not None:
+            self._labels.move_to_end(text)
+            return cached
+
+        placed, pen = [], 0.0
+        for mask, left, top, advance in self._split(text):
+            placed.append((mask, int(round(pen)) + left, top))
+            pen += advance
+        if not placed:
+            placed.append((np.zeros((1, 1), dtype=np.uint8), 0, 0))
+        x_min = min(x for _, x, _ in placed)
+        y_min = min(y for _, _, y in placed)
+        x_max = max(x + m.shape[1] for m, x, _ in placed)
+        y_max = max(y + m.shape[0] for m, _, y in placed)
+        strip = np.zeros((y_max - y_min, x_max - x_min), dtype=np.uint8)
+        for mask, x, y in placed:
+            target = strip[y - y_min:y - y_min + mask.shape[0], x - x_min:x - x_min + mask.shape[1]]
+            np.maximum(target, mask, out=target)
+
+        result = (strip, x_min, y_min)
+        self._labels[text] = result
+        if len(self._labels) > HUD_LABEL_CACHE_SIZE:
+            self._labels.popitem(last=False)
+        return result
+
+class HudOverlay:
+    """Speed and distance labels composited straight into the frame buffer."""
+    def __init__(self, fonts=None):
+        font_huge, font_large = fonts or load_hud_fonts()
+        self.speed_atlas = GlyphAtlas(font_huge)
+        self.distance_atlas = GlyphAtlas(font_large)
+
+    def draw_label(self, frame, atlas, text, position, color):
+        strip, dx, dy = atlas.label(text)
+        alpha_blend(frame, strip, color, position[0] + dx, position[1] + dy)
+
+    def labels(self, pos):
+        """The label text for a camera position; frames with equal labels draw identical HUDs."""
+        return f"{int(pos['speed'])} km/h", f"{pos['distance_km']:.1f} km"
+
+    def draw(self, frame, pos, labels=None):
+        speed_text, distance_text = labels or self.labels(pos)
+        self.draw_label(frame, self.speed_atlas, speed_text, HUD_SPEED_POS, HUD_SPEED_COLOR)
+        self.draw_label(frame, self.distance_atlas, distance_text, HUD_DISTANCE_POS, HUD_DISTANCE_COLOR)
+
+_hud_overlay = None
+
+def get_hud_overlay():
+    global _hud_overlay
+    if _hud_overlay is None:
+        _hud_overlay = HudOverlay()
+    return _hud_overlay
+
+# ============================================================================
+# VIDEO RENDERING (OPTIMIZED PROGRESS)
+# ============================================================================
+def rendition_paths(output_path):
+    """Where each output of a render goes, next to the full-size MP4 at output_path."""
+    base = os.path.splitext(output_path)[0]
+    return {
+        'full': output_path,
+        'mobile': f"{base}_{RENDITION_HEIGHT}p.mp4",
+        'hls': os.path.join(f"{base}_hls", 'index.m3u8'),
+        'thumbnails': f"{base}_thumbs.jpg",
+        'poster': f"{base}_poster.jpg",
+    }
+
+class RenditionWriter:
+    """One ffmpeg pass per segment: full MP4, RENDITION_HEIGHT MP4 + HLS .ts, and a first-frame JPEG."""
+    def __init__(self, files, start_frame=0, fps=VIDEO_FPS):
+        import imageio_ffmpeg
+        x264 = ['-c:v', 'libx264', '-preset', SEGMENT_ENCODING_PRESET, '-pix_fmt', 'yuv420p']
+        cmd = [
+            imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{VIDEO_WIDTH}x{VIDEO_HEIGHT}", '-r', str(fps), '-i', '-',
+            '-filter_complex', f"[0:v]split=3[full][small][thumb];[small]scale=-2:{RENDITION_HEIGHT}[mobile];"
+                               f"[thumb]trim=end_frame=1,scale={THUMBNAIL_WIDTH}:-2[poster]",
+            '-map', '[full]', *x264, '-crf', str(ENCODING_CRF), files['full'],
+            # Offset so consecutive HLS segments carry continuous timestamps
+            '-map', '[mobile]', *x264, '-crf', str(RENDITION_CRF),
+            '-output_ts_offset', f"{start_frame / fps:.6f}",
+            '-f', 'tee', f"[f=mp4]{files['mobile']}|[f=mpegts]{files['hls']}",
+            '-map', '[poster]', '-frames:v', '1', files['thumb'],
+        ]
+        self._stderr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr)
+
+    def append_data(self, frame):
+        try:
+            self.proc.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        except (BrokenPipeError, OSError):
+            self.close()
+            raise
+
+    def close(self):
+        if self.proc.stdin.closed: return
+        self.proc.stdin.close()
+        code = self.proc.wait()
+        self._stderr.seek(0)
+        error = self._stderr.read().decode('utf-8', 'replace').strip()
+        self._stderr.close()
+        if code != 0:
+            raise RuntimeError(f"ffmpeg exited with {code}: {error[-500:]}")
+
+    def abort(self):
+        """Kill the encoder without finishing the files (cancelled or failed segment)."""
+        self.proc.kill()
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        self.proc.wait()
+        self._stderr.close()
+
+def render_frames(camera_positions, writer, on_frame=None):
+    """
+    Compose camera_positions into writer; frames identical to the previous one reuse its buffer.
+    Returns map cache hit/miss deltas and how many backgrounds failed.
+    """
+    background = np.full((VIDEO_HEIGHT, VIDEO_WIDTH, 3), 20, dtype=np.uint8)
+    background_key = None  # camera the current background was drawn for
+    prev_array = None
+    prev_key = None
+    map_cache = get_static_map_cache()
+    stats_before = map_cache.stats()
+    hud = get_hud_overlay()
     total_frames = len(camera_positions)
     
-    # CRITICAL: Update EVERY 5 frames minimum (constant heartbeat)
-    update_interval = 5
+    # Every Nth frame gets a fresh background; all of them are known up front
+    download_frames = range(0, total_frames, BACKGROUND_REFRESH_INTERVAL) if MAPBOX_API_KEY or get_tile_source() else range(0)
+    backgrounds = prefetch_map_backgrounds(camera_positions, download_frames, map_cache)
+    telemetry = current_telemetry() or Telemetry()
+    clock = time.perf_counter
+    failed = 0
+    try:
+        t0 = clock()
+        next_background = next(backgrounds, None)
+        telemetry.add_time('fetch', clock() - t0)
+        for i, pos in enumerate(camera_positions):
+            check_cancelled()
+            if on_frame: on_frame(i)
+
+            try:
+                t0 = clock()
+                if next_background is not None and next_background[0] == i:
+                    if next_background[1] is not None:
+                        # Same quantized camera means the same map image: keep the buffer we have
+                        key = quantize_camera(pos)
+                        if key != background_key:
+                            background, background_key = next_background[1], key
+                    else:
+                        failed += 1
+                    # Time spent here is the renderer waiting on the network
+                    next_background = next(backgrounds, None)
+                t1 = clock()
+                
+                labels = hud.labels(pos)
+                frame_key = (background_key, labels)
+                if prev_array is not None and frame_key == prev_key:
+                    frame = prev_array
+                    telemetry.count('frames_elided')
+                else:
+                    frame = background.copy()
+                    hud.draw(frame, pos, labels)
+                t2 = clock()
+                
+                # Stream straight into the encoder (only the previous frame is kept)
+                writer.append_data(frame)
+                prev_array, prev_key = frame, frame_key
+                telemetry.add_time('fetch', t1 - t0)
+                telemetry.add_time('compose', t2 - t1)
+                telemetry.add_time('encode', clock() - t2)
+                telemetry.count('frames')
+                
+            except Exception:
+                if prev_array is not None:
+                    writer.append_data(prev_array)
+                    telemetry.count('frames')
+    finally:
+        backgrounds.close()
     
-    for i, pos in enumerate(camera_positions):
-        # HYPER-FREQUENT UPDATES
-        if i % update_interval == 0 or i == total_frames - 1:
-            pct = 55 + int((i / total_frames) * 35)
-            send_progress("Rendering video", pct, f"Frame {i}/{total_frames}")
-        
-        # HEARTBEAT: Even between updates, send a keep-alive
-        elif i % 2 == 0:
-            # Silent heartbeat (no progress change, just connection keep-alive)
-            print(f"PROGRESS:{json.dumps({'message': 'rendering...', 'stage': 'processing'})}", flush=True)
+    stats = map_cache.stats()
+    return {'hits': stats['hits'] - stats_before['hits'], 'misses': stats['misses'] - stats_before['misses'],
+            'failed_backgrounds': failed}
 
-        try:
-            should_download = (i == 0) or (i % 3 == 0)
-            
-            if should_download and MAPBOX_API_KEY:
-                url = f"https://api.mapbox.com/styles/v1/mapbox/satellite-streets-v12/static/{pos['lon']},{pos['lat']},{pos['zoom']},{int(pos['bearing'])},{int(pos['pitch'])}/800x600@2x?access_token={MAPBOX_API_KEY}"
-                resp = requests.get(url, timeout=5)
-                if resp.status_code == 200:
-                    last_frame = Image.open(BytesIO(resp.content)).resize((VIDEO_WIDTH, VIDEO_HEIGHT))
-            
-            if last_frame:
-                img = last_frame.copy()
-            else:
-                img = Image.new('RGB', (VIDEO_WIDTH, VIDEO_HEIGHT), (20, 20, 20))
-
-            draw = ImageDraw.Draw(img)
-            draw.text((50, 50), f"{int(pos['speed'])} km/h", fill=(0, 255, 136), font=font_huge)
-            draw.text((50, 150), f"{pos['distance_km']:.1f} km", fill=(255, 255, 255), font=font_large)
-            
-            frames.append(np.array(img))
-            
-        except Exception:
-            if frames: 
-                frames.append(frames[-1])
+def render_pool_context():
+    """Forkserver (else spawn) context: forked children would deadlock on the --worker locks."""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def segment_files(segment_dir, n):
+    """The per-segment outputs of RenditionWriter."""
+    base = os.path.join(segment_dir, f"segment_{n:05d}")
+    return {'full': base + '.mp4', 'mobile': base + '_mobile.mp4', 'hls': base + '.ts', 'thumb': base + '.jpg'}
+
+def _write_segment(camera_positions, files, start_frame=0, on_frame=None):
+    check_cancelled()
+    writer = RenditionWriter(files, start_frame)
+    try:
+        stats = render_frames(camera_positions, writer, on_frame=on_frame)
+    except BaseException:
+        # The partial segment is thrown away; don't wait for ffmpeg to finish it
+        writer.abort()
+        raise
+    with stage_span('encode'):
+        writer.close()
+    return stats
+
+def _init_render_process(cancel_event):
+    # The job's cancel flag, shared with the parent, so check_cancelled works here too
+    _job_context.cancel_event = cancel_event
+
+def _render_segment(camera_positions, files, start_frame):
+    # Timings are collected per process and merged into the job's telemetry
+    telemetry = _job_context.telemetry = Telemetry()
+    stats = _write_segment(camera_positions, files, start_frame)
+    return files, stats, telemetry.snapshot()
 
-    send_progress("Rendering video", 90, "Encoding video file...")
+def concat_segments(segment_paths, output_path):
+    """Join H.264 segments losslessly with ffmpeg's concat demuxer."""
+    import imageio_ffmpeg
+    list_path = output_path + '.segments.txt'
+    with open(list_path, 'w') as f:
+        for path in segment_paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+    try:
+        subprocess.run(
+            [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error',
+             '-f', 'concat', '-safe', '0', '-i', list_path,
+             '-c', 'copy', '-movflags', '+faststart', output_path],
+            check=True, stdout=subprocess.DEVNULL
+        )
+    finally:
+        os.remove(list_path)
+
+class HlsPlaylist:
+    """EVENT playlist; segments are published in order as they finish and close() adds ENDLIST."""
+    def __init__(self, playlist_path, target_seconds):
+        self.path = playlist_path
+        self.dir = os.path.dirname(playlist_path)
+        self.target = max(1, math.ceil(target_seconds))
+        self.entries = []
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.makedirs(self.dir)
+
+    def publish(self, ts_path, seconds):
+        name = f"segment_{len(self.entries):05d}.ts"
+        shutil.copyfile(ts_path, os.path.join(self.dir, name))
+        self.entries.append((name, seconds))
+        self._write(ended=False)
+
+    def close(self):
+        self._write(ended=True)
+
+    def _write(self, ended):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-PLAYLIST-TYPE:EVENT',
+                 f"#EXT-X-TARGETDURATION:{self.target}", '#EXT-X-MEDIA-SEQUENCE:0']
+        for name, seconds in self.entries:
+            lines += [f"#EXTINF:{seconds:.3f},", name]
+        if ended: lines.append('#EXT-X-ENDLIST')
+        # Players poll this file; replace it atomically
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
+
+def write_thumbnail_strip(thumb_paths, strip_path, poster_path):
+    """One thumbnail per segment side by side, plus the first one as the poster."""
+    thumbs = [Image.open(p).convert('RGB') for p in thumb_paths if os.path.exists(p)]
+    if not thumbs: return
+    strip = Image.new('RGB', (sum(t.width for t in thumbs), max(t.height for t in thumbs)))
+    x = 0
+    for thumb in thumbs:
+        strip.paste(thumb, (x, 0))
+        x += thumb.width
+    strip.save(strip_path, quality=85)
+    thumbs[0].save(poster_path, quality=85)
+
+def segment_bounds(total_frames, chunk_frames=None):
+    """[(start, stop)] chunks of the camera path; each starts on a background refresh frame."""
+    chunk_frames = chunk_frames or RENDER_CHUNK_FRAMES
+    chunk_frames = max(BACKGROUND_REFRESH_INTERVAL, chunk_frames - chunk_frames % BACKGROUND_REFRESH_INTERVAL)
+    return [(start, min(start + chunk_frames, total_frames)) for start in range(0, total_frames, chunk_frames)]
+
+def render_video_segments(camera_positions, output_path, workers=None, chunk_frames=None, checkpoints=None):
+    """
+    Render chunks of the camera path (on a process pool when workers > 1), publish them on
+    the HLS playlist as they finish and join each rendition; checkpointed chunks are reused.
+    """
+    workers = workers or RENDER_WORKERS
+    total_frames = len(camera_positions)
+    if total_frames == 0:
+        raise ValueError("No frames to render: the trip needs at least two distinct GPS points")
+    bounds = segment_bounds(total_frames, chunk_frames)
+    outputs = rendition_paths(output_path)
+    segment_dir = tempfile.mkdtemp(prefix='segments_', dir=os.path.dirname(os.path.abspath(output_path)))
+    files = [segment_files(segment_dir, n) for n in range(len(bounds))]
+    playlist = HlsPlaylist(outputs['hls'], (bounds[0][1] - bounds[0][0]) / VIDEO_FPS)
+    done = [False] * len(bounds)
+    hits = misses = 0
+    telemetry = current_telemetry()
+
+    def publish_ready():
+        # Only a contiguous prefix can be played, so publish in order
+        while len(playlist.entries) < len(bounds) and done[len(playlist.entries)]:
+            n = len(playlist.entries)
+            playlist.publish(files[n]['hls'], (bounds[n][1] - bounds[n][0]) / VIDEO_FPS)
+            if n == 0:
+                send_progress("Rendering video", 55, "Preview available", stage="preview", playlist=outputs['hls'])
     
-    imageio.mimsave(
-        output_path, frames, fps=VIDEO_FPS, 
-        codec='libx264', pixelformat='yuv420p',
-        output_params=['-crf', str(ENCODING_CRF), '-preset', 'ultrafast']
-    )
+    try:
+        todo = []
+        for n, (start, stop) in enumerate(bounds):
+            done[n] = bool(checkpoints and checkpoints.restore_segment(start, stop, files[n]))
+            if not done[n]: todo.append(n)
+        publish_ready()
+        reused = len(bounds) - len(todo)
+        send_progress("Rendering video", 55, f"Rendering {len(todo)} segments on {workers} workers"
+                                             + (f" ({reused} reused)..." if reused else "..."))
+
+        def finished(n, stats):
+            nonlocal hits, misses
+            hits += stats['hits']
+            misses += stats['misses']
+            # A segment drawn over missing backgrounds is not worth keeping
+            if checkpoints and not stats['failed_backgrounds']:
+                checkpoints.store_segment(*bounds[n], files[n])
+            done[n] = True
+            publish_ready()
+
+        if workers > 1 and len(todo) > 1:
+            mp_context = render_pool_context()
+            segments_cancelled = mp_context.Event()
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                                     initializer=_init_render_process, initargs=(segments_cancelled,)) as pool:
+                try:
+                    pending = {
+                        pool.submit(_render_segment, camera_positions[bounds[n][0]:bounds[n][1]], files[n], bounds[n][0]): n
+                        for n in todo
+                    }
+                    done_count = reused
+                    while pending:
+                        completed, _ = wait(pending, timeout=2, return_when=FIRST_COMPLETED)
+                        for future in completed:
+                            _, stats, segment_telemetry = future.result()
+                            finished(pending.pop(future), stats)
+                            if telemetry: telemetry.merge(segment_telemetry)
+                            done_count += 1
+                        pct = 55 + int((done_count / len(bounds)) * 35)
+                        send_progress("Rendering video", pct, f"Segment {done_count}/{len(bounds)}")
+                except BaseException:
+                    # Cancelled or a segment failed: running segments stop at their next
+                    # frame and queued ones return at once, so this wait is short
+                    segments_cancelled.set()
+                    pool.shutdown(wait=True, cancel_futures=True)
+                    raise
+        else:
+            for n in todo:
+                start, stop = bounds[n]
+                def on_frame(i):
+                    # Throttled in send_progress; doubles as the keep-alive
+                    pct = 55 + int(((start + i) / total_frames) * 35)
+                    send_progress("Rendering video", pct, f"Frame {start + i}/{total_frames}")
+                finished(n, _write_segment(camera_positions[start:stop], files[n], start, on_frame=on_frame))
+        
+        send_progress("Rendering video", 90, f"Joining segments... (map cache: {hits} hits, {misses} misses)", force=True)
+        playlist.close()
+        with stage_span('encode'):
+            concat_segments([f['full'] for f in files], outputs['full'])
+            concat_segments([f['mobile'] for f in files], outputs['mobile'])
+            write_thumbnail_strip([f['thumb'] for f in files], outputs['thumbnails'], outputs['poster'])
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+def render_video_static_fallback(camera_positions, gps_df, photo_data, output_path, checkpoints=None):
+    send_progress("Rendering video", 55, "Starting rendering engine...")
     
+    total_frames = len(camera_positions)
+    if MAP_TILE_URL:
+        # One pass over the route's tiles instead of a request per background
+        with stage_span('fetch'):
+            needed, available = seed_route_tiles(camera_positions, range(0, total_frames, BACKGROUND_REFRESH_INTERVAL))
+        send_progress("Rendering video", 55, f"Map tiles ready: {available}/{needed}")
+    render_video_segments(camera_positions, output_path, checkpoints=checkpoints)
     send_progress("Completed", 100, "Video generation successful!", stage="success")
 
+# ============================================================================
+# STAGE CHECKPOINTS
+# ============================================================================
+CHECKPOINT_STAGES = ('gps', 'stops', 'photos', 'camera')
+_checkpoint_caches = {}
+_checkpoint_caches_lock = threading.Lock()
+
+def checkpoint_dir(uploads_dir=None):
+    return CHECKPOINT_DIR or os.path.join(uploads_dir or UPLOADS_BASE_DIR, 'cache', 'checkpoints')
+
+def get_checkpoint_cache(uploads_dir=None):
+    directory = checkpoint_dir(uploads_dir)
+    with _checkpoint_caches_lock:
+        if directory not in _checkpoint_caches:
+            _checkpoint_caches[directory] = DiskCache(directory, max_bytes=CHECKPOINT_MAX_MB * 1024 * 1024, suffix='.ckpt')
+        return _checkpoint_caches[directory]
+
+def stage_settings(stage):
+    """The settings a stage's output depends on; changing any of them invalidates its checkpoint."""
+    if stage == 'gps':
+        return {'trip': TRIP_CACHE_VERSION, 'smooth': [SMOOTH_WINDOW, USE_GAUSSIAN_SMOOTHING],
+                'matching': bool(USE_MAP_MATCHING and MAPBOX_API_KEY) and
+                            [MAP_MATCHING_PROFILE, MAP_MATCHING_RADIUS, MAP_MATCHING_BATCH_SIZE, MAP_MATCHING_OVERLAP]}
+    if stage == 'stops':
+        return [ENABLE_STOP_DETECTION, STOP_SPEED_THRESHOLD, STOP_MIN_DURATION, STOP_MIN_DISTANCE]
+    if stage == 'photos':
+        return [MAX_STOP_PHOTOS, STREETVIEW_SIZE, bool(GOOGLE_API_KEY)]
+    if stage == 'camera':
+        return [VIDEO_FPS, TARGET_VIDEO_DURATION_MINUTES, DYNAMIC_CAMERA,
+                ADAPTIVE_SAMPLING, MIN_FRAMES_PER_SEGMENT, MAX_FRAMES_PER_SEGMENT, SIMPLIFY_TOLERANCE_M,
+                FRAME_WEIGHT_TURN, FRAME_WEIGHT_SPEED_CHANGE, FRAME_WEIGHT_STOP, STOP_SPEED_THRESHOLD,
+                CAMERA_ZOOM_BASE, CAMERA_ZOOM_MIN, CAMERA_ZOOM_MAX,
+                CAMERA_PITCH_BASE, CAMERA_PITCH_MIN, CAMERA_PITCH_MAX]
+    if stage == 'segment':
+        return {'video': [VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_FPS, ENCODING_CRF, BACKGROUND_REFRESH_INTERVAL,
+                          SEGMENT_ENCODING_PRESET, RENDITION_HEIGHT, RENDITION_CRF, THUMBNAIL_WIDTH],
+                'map': [MAP_STYLE, MAP_IMAGE_SIZE, bool(MAPBOX_API_KEY), MAP_TILE_SOURCE, MAP_TILE_URL, MAP_TILE_SIZE],
+                'hud': [HUD_SPEED_POS, HUD_SPEED_COLOR, HUD_DISTANCE_POS, HUD_DISTANCE_COLOR]}
+    raise ValueError(f"Unknown stage: {stage}")
+
+def chain_key(parent, stage, **extra):
+    payload = json.dumps({'parent': parent, 'stage': stage, 'version': CHECKPOINT_VERSION,
+                          'settings': stage_settings(stage), **extra}, sort_keys=True)
+    return f"{stage}:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+def encode_gps(gps_df):
+    buf = BytesIO()
+    write_frame_npz(gps_df, buf)
+    return buf.getvalue()
+
+def decode_gps(data):
+    return read_frame_npz(BytesIO(data))
+
+def encode_camera(positions):
+    buf = BytesIO()
+    np.save(buf, positions, allow_pickle=False)
+    return buf.getvalue()
+
+def decode_camera(data):
+    return np.load(BytesIO(data), allow_pickle=False)
+
+def encode_photos(photo_data):
+    return json.dumps({str(k): v for k, v in photo_data.items()}, default=float).encode('utf-8')
+
+def decode_photos(data):
+    photo_data = {int(k): v for k, v in json.loads(data).items()}
+    # Files under another uploads dir may have been cleaned up; re-capture then
+    if not all(os.path.exists(p['photo_path']) for p in photo_data.values()):
+        raise FileNotFoundError("checkpointed stop photo is missing")
+    return photo_data
+
+class StageCheckpoints:
+    """
+    Stage outputs of one job in a DiskCache, keyed by a chain from the input SHA-1 and each
+    stage's settings; force=True recomputes and overwrites.
+    """
+    def __init__(self, input_sha1, cache=None, force=False, segments=SEGMENT_CHECKPOINTS):
+        self.cache = cache or get_checkpoint_cache()
+        self.force = force
+        self.segments = segments
+        gps = chain_key(input_sha1, 'gps')
+        stops = chain_key(gps, 'stops')
+        self.keys = {'gps': gps, 'stops': stops, 'photos': chain_key(stops, 'photos'),
+                     'camera': chain_key(gps, 'camera')}
+
+    def stage(self, name, compute, encode, decode):
+        """Return the stored output of a stage, or compute and store it."""
+        if not self.force:
+            data = self.cache.get(self.keys[name])
+            if data is not None:
+                try:
+                    value = decode(data)
+                    telemetry_count('checkpoint_hits')
+                    return value
+                except Exception:
+                    pass  # unreadable or stale: recompute below
+        telemetry_count('checkpoint_misses')
+        value = compute()
+        self.cache.put(self.keys[name], encode(value))
+        return value
+
+    def segment_key(self, start, stop):
+        return chain_key(self.keys['camera'], 'segment', frames=[start, stop])
+
+    def restore_segment(self, start, stop, files):
+        """Write a stored segment's files ({rendition: path}); False unless all are stored."""
+        if self.force or not self.segments: return False
+        key = self.segment_key(start, stop)
+        if not all(f"{key}:{name}" in self.cache for name in files): return False
+        for name, path in files.items():
+            data = self.cache.get(f"{key}:{name}")
+            if data is None: return False
+            with open(path, 'wb') as f:
+                f.write(data)
+        telemetry_count('checkpoint_hits')
+        return True
+
+    def store_segment(self, start, stop, files):
+        if not self.segments: return
+        key = self.segment_key(start, stop)
+        for name, path in files.items():
+            with open(path, 'rb') as f:
+                self.cache.put(f"{key}:{name}", f.read())
+
+def inspect_checkpoints(gps_file, uploads_dir=None):
+    """Report which stages of gps_file are checkpointed under the current settings."""
+    checkpoints = StageCheckpoints(file_sha1(gps_file), cache=get_checkpoint_cache(uploads_dir))
+    cache = checkpoints.cache
+    report = {
+        'input_sha1': file_sha1(gps_file),
+        'checkpoint_dir': checkpoint_dir(uploads_dir),
+        'stages': {name: key in cache for name, key in checkpoints.keys.items()},
+        'segments': None,
+    }
+    camera = cache.get(checkpoints.keys['camera'])
+    if camera is not None:
+        bounds = segment_bounds(len(decode_camera(camera)))
+        report['segments'] = {'stored': sum(f"{checkpoints.segment_key(*b)}:full" in cache for b in bounds),
+                              'total': len(bounds)}
+    print(json.dumps(report, indent=2))
+    return report
+
 # ============================================================================
 # MAIN FUNCTION
 # ============================================================================
-def main(gps_file, uploads_dir=None):
-    global UPLOADS_BASE_DIR, FRAMES_DIR, PHOTO_DIR, VIDEOS_DIR, OUTPUT_VIDEO
-    
-    if uploads_dir:
-        UPLOADS_BASE_DIR, FRAMES_DIR, PHOTO_DIR, VIDEOS_DIR = setup_environment(uploads_dir)
-        OUTPUT_VIDEO = os.path.join(VIDEOS_DIR, "relive_full_quality.mp4")
+@dataclass
+class JobConfig:
+    """Everything one render job needs that used to live in module globals."""
+    gps_file: str
+    uploads_dir: str
+    photo_dir: str
+    videos_dir: str
+    output_path: str
+    job_id: str = None
+    checkpoints: bool = True
+    segment_checkpoints: bool = SEGMENT_CHECKPOINTS
+    force: bool = False
+
+def make_job_config(gps_file, uploads_dir=None, output_path=None, job_id=None, checkpoints=True,
+                    segment_checkpoints=SEGMENT_CHECKPOINTS, force=False):
+    uploads_dir, _, photo_dir, videos_dir = setup_environment(uploads_dir)
+    if output_path is None:
+        output_path = os.path.join(videos_dir, os.path.basename(OUTPUT_VIDEO))
+    return JobConfig(gps_file=gps_file, uploads_dir=uploads_dir, photo_dir=photo_dir,
+                     videos_dir=videos_dir, output_path=output_path, job_id=job_id,
+                     checkpoints=checkpoints, segment_checkpoints=segment_checkpoints, force=force)
+
+def run_job(config):
+    telemetry = _job_context.telemetry = Telemetry()
+    status = "success"
+    checkpoints = None
+    if config.checkpoints:
+        checkpoints = StageCheckpoints(file_sha1(config.gps_file), cache=get_checkpoint_cache(config.uploads_dir),
+                                       force=config.force, segments=config.segment_checkpoints)
+
+    def stage(name, compute, encode, decode):
+        # Reuse a stage's stored output when its input and settings are unchanged
+        if checkpoints is None: return compute()
+        return checkpoints.stage(name, compute, encode, decode)
+
+    def load_and_process():
+        # Load GPS data (any supported format; cached by content hash)
+        with telemetry.span('load'):
+            gps_df = load_trip(config.gps_file)
+        return process_gps_data(gps_df)
 
     try:
-        # Load GPS data
-        df = pd.read_excel(gps_file)
-        col_map = {c.lower(): c for c in df.columns}
-        
-        lat_col = next((c for c in col_map if 'lat' in c), None)
-        lon_col = next((c for c in col_map if 'lon' in c or 'lng' in c), None)
-        
-        if not lat_col or not lon_col:
-            raise ValueError("Could not find latitude/longitude columns in data")
-        
-        gps_df = pd.DataFrame({
-            'Latitude': df[col_map[lat_col]], 
-            'Longitude': df[col_map[lon_col]]
-        })
-        gps_df = gps_df.dropna()
-        
-        # Process data
-        gps_df = process_gps_data(gps_df)
+        # Process data (map matching is recorded as its own stage)
+        with telemetry.span('speed_bearing'):
+            gps_df = stage('gps', load_and_process, encode_gps, decode_gps)
         
         # Detect stops
-        stops = detect_stops(gps_df) if ENABLE_STOP_DETECTION else []
-        photo_data = capture_stop_photos(gps_df, stops) if stops else {}
+        with telemetry.span('stops'):
+            stops = stage('stops', lambda: detect_stops(gps_df) if ENABLE_STOP_DETECTION else [],
+                          lambda v: json.dumps([int(i) for i in v]).encode('utf-8'), json.loads)
+        with telemetry.span('photos'):
+            photo_data = stage('photos', lambda: capture_stop_photos(gps_df, stops, photo_dir=config.photo_dir) if stops else {},
+                               encode_photos, decode_photos)
         
         # Generate frames
-        positions = generate_adaptive_frames(gps_df)
+        with telemetry.span('frame_path'):
+            positions = stage('camera', lambda: generate_adaptive_frames(gps_df), encode_camera, decode_camera)
         
-        # Render video
-        render_video_static_fallback(positions, gps_df, photo_data, OUTPUT_VIDEO)
+        # Render video (fetch/compose/encode are split out per frame)
+        with telemetry.span('render'):
+            render_video_static_fallback(positions, gps_df, photo_data, config.output_path, checkpoints=checkpoints)
         
-        return OUTPUT_VIDEO
+        return config.output_path
         
+    except JobCancelled:
+        status = "cancelled"
+        raise
     except Exception as e:
+        status = "error"
         # Ensure error is sent before crash
         send_progress("Error", 0, str(e), stage="error")
-        sys.stdout.flush()
         raise e
+    finally:
+        # One machine-readable line per job: where the time went and what was fetched
+        emit_line("SUMMARY", {"status": status, **telemetry.summary()})
+        _job_context.telemetry = None
+
+def main(gps_file, uploads_dir=None, output_path=None, checkpoints=True, segment_checkpoints=SEGMENT_CHECKPOINTS, force=False):
+    return run_job(make_job_config(gps_file, uploads_dir, output_path, checkpoints=checkpoints,
+                                   segment_checkpoints=segment_checkpoints, force=force))
+
+# ============================================================================
+# PERSISTENT WORKER
+# ============================================================================
+def _run_worker_job(request, cancel_event):
+    _job_context.job_id = request['id']
+    _job_context.cancel_event = cancel_event
+    started = time.time()
+    try:
+        config = make_job_config(request['gps_file'], request.get('uploads_dir'),
+                                 request.get('output'), job_id=request['id'],
+                                 segment_checkpoints=bool(request.get('segment_checkpoints', SEGMENT_CHECKPOINTS)),
+                                 force=bool(request.get('force')))
+        output_path = run_job(config)
+        renditions = {name: path for name, path in rendition_paths(output_path).items() if os.path.exists(path)}
+        emit_line("RESULT", {"status": "success", "output": output_path, "renditions": renditions,
+                             "elapsed_s": round(time.time() - started, 3)})
+    except JobCancelled:
+        emit_line("RESULT", {"status": "cancelled"})
+    except Exception as e:
+        emit_line("RESULT", {"status": "error", "message": str(e)})
+    finally:
+        _job_context.job_id = None
+        _job_context.cancel_event = None
+
+def run_worker(max_jobs=None, stream=None):
+    """
+    Serve JSON-line render jobs and cancel/ping/shutdown commands from stdin until EOF;
+    replies are PROGRESS, SUMMARY and RESULT lines tagged with the job id.
+    """
+    max_jobs = max_jobs or WORKER_MAX_JOBS
+    stream = stream or sys.stdin
+    jobs = {}
+    executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='render-job')
+    emit_line("READY", {"pid": os.getpid(), "max_jobs": max_jobs})
+    try:
+        for line in stream:
+            line = line.strip()
+            if not line: continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                emit_line("RESULT", {"status": "error", "message": "Malformed request"})
+                continue
+            
+            cmd = request.get('cmd', 'render')
+            if cmd == 'shutdown':
+                break
+            if cmd == 'ping':
+                emit_line("PONG", {"active_jobs": len(jobs)})
+            elif cmd == 'cancel':
+                job = jobs.get(request.get('id'))
+                if job: job[0].set()
+            elif cmd == 'render':
+                if not request.get('id') or not request.get('gps_file'):
+                    emit_line("RESULT", {"job": request.get('id'), "status": "error", "message": "Job needs 'id' and 'gps_file'"})
+                    continue
+                cancel_event = threading.Event()
+                future = executor.submit(_run_worker_job, request, cancel_event)
+                jobs[request['id']] = (cancel_event, future)
+                future.add_done_callback(lambda _, job_id=request['id']: jobs.pop(job_id, None))
+    finally:
+        executor.shutdown(wait=True)
+
+# ============================================================================
+# STARTUP BENCHMARK
+# ============================================================================
+STARTUP_PROBE_MODULES = ['numpy', 'PIL.Image', 'pandas', 'scipy.ndimage', 'imageio_ffmpeg', 'requests']
+
+def _time_fresh_interpreter(snippet):
+    """Wall time of running `snippet` in a new interpreter."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', snippet], check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def benchmark_startup(runs=5):
+    """Measure interpreter start plus module import, and the import cost of each deferred dependency."""
+    def best(snippet):
+        return min(_time_fresh_interpreter(snippet) for _ in range(runs))
+
+    baseline = best('pass')
+    module_path = os.path.abspath(__file__)
+    results = {
+        'interpreter_s': round(baseline, 4),
+        'module_import_s': round(best(f"import runpy; runpy.run_path({module_path!r}, run_name='startup_probe')") - baseline, 4),
+        'deferred_imports_s': {
+            name: round(best(f"import {name}") - baseline, 4) for name in STARTUP_PROBE_MODULES
+        },
+        'runs': runs,
+    }
+    print(json.dumps(results, indent=2))
+    return results
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Render a trip video from an OBD/GPS export.")
+    parser.add_argument('gps_file', nargs='?', help="Trip file to render")
+    parser.add_argument('uploads_dir', nargs='?', help="Base directory for outputs (default: ./uploads)")
+    parser.add_argument('--install', action='store_true', help="Install system and Python dependencies first")
+    parser.add_argument('--startup-benchmark', action='store_true', help="Measure interpreter + import cost and exit")
+    parser.add_argument('--worker', action='store_true', help="Serve JSON render jobs from stdin (see run_worker)")
+    parser.add_argument('--jobs', type=int, default=None, help="Concurrent jobs in --worker mode")
+    parser.add_argument('--output', help="Output video path (default: <uploads_dir>/videos/relive_full_quality.mp4)")
+    parser.add_argument('--force', action='store_true', help="Recompute every stage and overwrite its checkpoint")
+    parser.add_argument('--no-checkpoints', action='store_true', help="Neither read nor write stage checkpoints")
+    parser.add_argument('--segment-checkpoints', action='store_true',
+                        help="Also checkpoint encoded video segments (stores a second copy of each rendition)")
+    parser.add_argument('--inspect-checkpoints', action='store_true', help="Show which stages of gps_file are checkpointed and exit")
+    return parser.parse_args(argv)
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
\ No newline at end of file
+    args = parse_args()
+    if args.install:
+        install_system_packages()
+        install_python_packages()
+    if args.startup_benchmark:
+        benchmark_startup()
+    elif args.worker:
+        run_worker(args.jobs)
+    elif args.gps_file and args.inspect_checkpoints:
+        inspect_checkpoints(args.gps_file, args.uploads_dir)
+    elif args.gps_file:
+        main(args.gps_file, args.uploads_dir, args.output, checkpoints=not args.no_checkpoints,
+             segment_checkpoints=args.segment_checkpoints or SEGMENT_CHECKPOINTS, force=args.force)
\ No newline at end of file
@@ -1,13 +1,16 @@
 import Upload from "../models/Upload.js";
 import fs from "fs";
 import path from "path";
-import { spawn } from "child_process";
 import { fileURLToPath } from "url";
+import { renderPool } from "../services/renderWorkerPool.js";
 
 // Get current directory for ES6 modules
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
 
+// Paths stored in the DB are relative to uploads/ with forward slashes (served at /uploads)
+const toUploadsPath = (uploadsDir, absPath) => path.relative(uploadsDir, absPath).split(path.sep).join('/');
+
 // ------------------ SAVE UPLOAD ------------------
 export const saveUpload = async (req, res) => {
   try {
@@ -108,8 +111,13 @@ export const getUserVideos = async (req, res) => {
         { user: { $exists: false } }, // For populated videos without user
         { user: null }
       ],
-      status: 'success',
-      videoPath: { $ne: null }
+      // Renders still in progress are listed once their HLS preview is playable
+      $and: [{
+        $or: [
+          { status: 'success', videoPath: { $ne: null } },
+          { status: 'processing', hlsPath: { $ne: null } }
+        ]
+      }]
     }).sort({ uploadedAt: -1 });
 
     // If no videos in DB, return dummy videos for demo
@@ -220,31 +228,23 @@ export const generateVideo = async (req, res) => {
       status: 'processing',
       message: 'Video generation in progress...',
       progress: 0,
-      videoPath: `videos/video-${fileId}.mp4` // Placeholder path
+      videoPath: `videos/video-${fileId}.mp4`, // Placeholder path
+      hlsPath: null
     });
 
     // Send initial event
     res.write('data: {"stage": "processing", "message": "Starting video generation...", "progress": 0}\n\n');
 
-    // Delete any existing video file to prevent premature success
+    // Each job writes straight to its own file, so concurrent renders never collide
     const videosDir = path.join(uploadsDir, 'videos');
-    const videoPath = path.join(videosDir, 'relive_full_quality.mp4');
-    if (fs.existsSync(videoPath)) {
-      fs.unlinkSync(videoPath);
+    const uniqueVideoName = `video-${fileId}.mp4`;
+    const finalVideoPath = path.join(videosDir, uniqueVideoName);
+    if (fs.existsSync(finalVideoPath)) {
+      fs.unlinkSync(finalVideoPath);
     }
 
-    // Spawn Python process with unbuffered output
-    const python = spawn('python', ['-u', codePyPath, filePath, uploadsDir], {
-      cwd: backendDir,
-      env: {
-        ...process.env,
-        PYTHONUNBUFFERED: '1' // CRITICAL: Force Python unbuffered output
-      }
-    });
-
-    let errorOutput = '';
-    let stdoutBuffer = '';
     let lastProgressTime = Date.now();
+    let finished = false;
 
     // CRITICAL: Aggressive keep-alive (every 3 seconds)
     const keepAliveInterval = setInterval(() => {
@@ -263,180 +263,89 @@ export const generateVideo = async (req, res) => {
       }
     }, 3000);
 
-    // Parse Python output (line-buffered)
-    python.stdout.on('data', (data) => {
-      stdoutBuffer += data.toString();
-      lastProgressTime = Date.now(); // Update last activity time
-
-      const lines = stdoutBuffer.split(/\r?\n/);
-
-      for (let i = 0; i < lines.length - 1; i++) {
-        const output = lines[i].trim();
-        if (!output) continue;
-
-        console.log('[PYTHON OUTPUT]', output);
-
-        try {
-          // PRIORITY: Handle PROGRESS JSON (from optimized code.py)
-          if (output.startsWith('PROGRESS:')) {
-            const jsonPart = output.replace(/^PROGRESS:/, '');
-            try {
-              const progressObj = JSON.parse(jsonPart);
-
-              // Forward directly to frontend with proper formatting
-              const ssePayload = {
-                stage: progressObj.stage || 'processing',
-                progress: typeof progressObj.progress === 'number' ? progressObj.progress : undefined,
-                message: progressObj.message || '',
-                step: progressObj.step || undefined
-              };
-
-              res.write(`data: ${JSON.stringify(ssePayload)}\n\n`);
-              continue;
-            } catch (e) {
-              console.error('[ERROR] Failed to parse PROGRESS JSON:', e);
-            }
-          }
-
-          // FALLBACK: Legacy marker-based progress (for old code.py versions)
-          if (output.includes('📍 LOADING ALL GPS DATA') || output.includes('LOADING ALL GPS DATA')) {
-            res.write('data: {"stage": "processing", "message": "Loading GPS data...", "step": "Loading Data", "progress": 5}\n\n');
-            continue;
-          }
-
-          if (output.includes('🛣️  MAP MATCHING') || output.includes('MAP MATCHING')) {
-            res.write('data: {"stage": "processing", "message": "Matching GPS to roads...", "step": "Map Matching", "progress": 15}\n\n');
-            continue;
-          }
-
-          if (output.includes('🔍 COMPREHENSIVE STOP DETECTION') || output.includes('STOP DETECTION')) {
-            res.write('data: {"stage": "processing", "message": "Detecting stops...", "step": "Stop Detection", "progress": 25}\n\n');
-            continue;
-          }
-
-          if (output.includes('📸 CAPTURING STOP PHOTOS') || output.includes('CAPTURING STOP PHOTOS')) {
-            res.write('data: {"stage": "processing", "message": "Capturing photos...", "step": "Capturing Photos", "progress": 35}\n\n');
-            continue;
-          }
-
-          if (output.includes('📹 GENERATING ADAPTIVE FRAMES') || output.includes('GENERATING ADAPTIVE FRAMES')) {
-            res.write('data: {"stage": "processing", "message": "Generating frames...", "step": "Frame Generation", "progress": 50}\n\n');
-            continue;
-          }
-
-          if (output.includes('🌐 Generating HTML viewer') || output.includes('Generating HTML viewer')) {
-            res.write('data: {"stage": "processing", "message": "Generating visualization...", "step": "HTML Generation", "progress": 65}\n\n');
-            continue;
-          }
-
-          if (output.includes('📹 RENDERING') || output.includes('RENDERING VIDEO') || output.includes('🎬 RENDERING')) {
-            res.write('data: {"stage": "processing", "message": "Rendering video...", "step": "Rendering video", "progress": 75}\n\n');
-            continue;
-          }
-
-        } catch (e) {
-          console.error('[ERROR] Parsing output line:', e);
-        }
-      }
-
-      // Keep last partial line in buffer
-      stdoutBuffer = lines[lines.length - 1];
+    // CRITICAL: Handle client disconnect gracefully
+    req.on('close', () => {
+      if (finished) return;
+      console.log('[INFO] Client disconnected, cancelling render job');
+      clearInterval(keepAliveInterval);
+      renderPool.cancel(String(fileId));
     });
 
-    python.stderr.on('data', (data) => {
-      const output = data.toString();
-      errorOutput += output;
-      console.error('[PYTHON STDERR]', output);
-
-      // Only send critical errors (not warnings)
-      if (!output.includes('Warning') &&
-          !output.includes('DeprecationWarning') &&
-          !output.includes('FutureWarning')) {
-        const cleanMsg = output.substring(0, 200).replace(/"/g, '\\"').replace(/\n/g, ' ');
-        res.write(`data: {"stage": "error", "message": "${cleanMsg}"}\n\n`);
+    // Hand the job to a long-lived Python worker (no interpreter/import cold start)
+    const result = await renderPool.submit({
+      id: String(fileId),
+      gps_file: filePath,
+      uploads_dir: uploadsDir,
+      output: finalVideoPath
+    }, (progressObj) => {
+      lastProgressTime = Date.now();
+
+      // Forward directly to frontend with proper formatting
+      const ssePayload = {
+        stage: progressObj.stage || 'processing',
+        progress: typeof progressObj.progress === 'number' ? progressObj.progress : undefined,
+        message: progressObj.message || '',
+        step: progressObj.step || undefined
+      };
+
+      // First HLS segments are out: the video can be watched while the rest renders
+      if (progressObj.stage === 'preview' && progressObj.playlist) {
+        ssePayload.hlsPath = toUploadsPath(uploadsDir, progressObj.playlist);
+        Upload.findByIdAndUpdate(fileId, { hlsPath: ssePayload.hlsPath })
+          .catch(err => console.error('[ERROR] Failed to save preview playlist:', err));
       }
-    });
-
-    python.on('close', async (code) => {
-      clearInterval(keepAliveInterval);
-
-      if (code === 0) {
-        const videosDir = path.join(uploadsDir, 'videos');
-        const tempVideoPath = path.join(videosDir, 'relive_full_quality.mp4');
-
-        // ✅ FIX: Rename video uniquely using File ID so it doesn't get overwritten
-        const uniqueVideoName = `video-${fileId}.mp4`;
-        const finalVideoPath = path.join(videosDir, uniqueVideoName);
-
-        let finalStatus = 'success';
-        let finalMessage = "Video generated successfully!";
-        let videoFile = null;
-
-        if (fs.existsSync(tempVideoPath)) {
-          // Rename the file
-          fs.renameSync(tempVideoPath, finalVideoPath);
 
-          // Save relative path (e.g., "videos/video-123.mp4")
-          videoFile = path.join('videos', uniqueVideoName);
-        } else {
-          finalStatus = 'error';
-          finalMessage = "Video file not found after generation.";
-        }
+      res.write(`data: ${JSON.stringify(ssePayload)}\n\n`);
+    });
 
-        // Update the upload record with video path and status
-        await Upload.findByIdAndUpdate(fileId, {
-          status: finalStatus,
-          message: finalMessage,
-          progress: 100,
-          videoPath: videoFile
-        });
-
-        res.write(`data: {"stage": "${finalStatus}", "message": "${finalMessage}", "videoPath": "${videoFile}", "progress": 100}\n\n`);
-
-      } else if (code !== null) {
-        // Non-zero exit code
-        let finalStatus = 'error';
-        let errorMsg = `Video generation failed with code ${code}.`;
-        // ... logic ...
-        await Upload.findByIdAndUpdate(fileId, {
-          status: finalStatus,
-          message: errorMsg,
-          progress: 0
-        });
-        console.error(`[ERROR] Python exited with code ${code}`);
-        res.write(`data: {"stage": "error", "message": "Generation failed (exit code ${code}): ${errorMsg}"}\n\n`);
+    finished = true;
+    clearInterval(keepAliveInterval);
+
+    if (result.status === 'success') {
+      let finalStatus = 'success';
+      let finalMessage = "Video generated successfully!";
+      let videoFile = null;
+      // Smaller renditions written in the same pass (see rendition_paths in code.py)
+      const renditions = result.renditions || {};
+      const renditionPath = (name) => renditions[name] ? toUploadsPath(uploadsDir, renditions[name]) : null;
+
+      if (fs.existsSync(finalVideoPath)) {
+        // Save relative path (e.g., "videos/video-123.mp4")
+        videoFile = path.join('videos', uniqueVideoName);
+      } else {
+        finalStatus = 'error';
+        finalMessage = "Video file not found after generation.";
       }
 
-      res.end();
-    });
+      // Update the upload record with video path and status
+      await Upload.findByIdAndUpdate(fileId, {
+        status: finalStatus,
+        message: finalMessage,
+        progress: 100,
+        videoPath: videoFile,
+        previewPath: renditionPath('mobile'),
+        hlsPath: renditionPath('hls'),
+        thumbnailPath: renditionPath('poster')
+      });
 
-    // CRITICAL: Handle client disconnect gracefully
-    req.on('close', () => {
-      console.log('[INFO] Client disconnected, terminating Python process');
-      clearInterval(keepAliveInterval);
-
-      // Kill Python process tree
-      try {
-        python.kill('SIGTERM');
+      console.log(`[RENDER] Job ${fileId} finished in ${result.elapsed_s}s`);
+      res.write(`data: ${JSON.stringify({ stage: finalStatus, message: finalMessage, videoPath: videoFile, progress: 100 })}\n\n`);
 
-        // Force kill after 2 seconds if still alive
-        setTimeout(() => {
-          if (!python.killed) {
-            python.kill('SIGKILL');
-          }
-        }, 2000);
-      } catch (err) {
-        console.error('[ERROR] Failed to kill Python process:', err);
-      }
-    });
+    } else {
+      const errorMsg = result.status === 'cancelled'
+        ? 'Video generation cancelled.'
+        : `Video generation failed: ${result.message || 'unknown error'}`;
+      await Upload.findByIdAndUpdate(fileId, {
+        status: 'error',
+        message: errorMsg,
+        progress: 0,
+        hlsPath: null
+      });
+      console.error(`[ERROR] Render job ${fileId} ended with status ${result.status}`);
+      res.write(`data: ${JSON.stringify({ stage: 'error', message: errorMsg })}\n\n`);
+    }
 
-    // CRITICAL: Handle Python process errors
-    python.on('error', (err) => {
-      console.error('[ERROR] Python process error:', err);
-      clearInterval(keepAliveInterval);
-      res.write(`data: {"stage": "error", "message": "Failed to start video generation: ${err.message}"}\n\n`);
-      res.end();
-    });
+    res.end();
 
   } catch (err) {
     console.error('[ERROR] generateVideo exception:', err);
@@ -31,6 +31,18 @@ const uploadSchema = new mongoose.Schema({
         type: String,
         default: null
     },
+    previewPath: {
+        type: String,
+        default: null
+    },
+    hlsPath: {
+        type: String,
+        default: null
+    },
+    thumbnailPath: {
+        type: String,
+        default: null
+    },
     message: {
         type: String,
         default: null
@@ -0,0 +1,138 @@
+import path from "path";
+import { spawn } from "child_process";
+import { fileURLToPath } from "url";
+
+const __filename = fileURLToPath(import.meta.url);
+const __dirname = path.dirname(__filename);
+
+const BACKEND_DIR = path.dirname(__dirname);
+const CODE_PY_PATH = path.join(BACKEND_DIR, "code.py");
+
+// Pool shape: POOL_SIZE long-lived Python processes, each running JOBS_PER_WORKER jobs
+const POOL_SIZE = Number(process.env.RENDER_POOL_SIZE || 1);
+const JOBS_PER_WORKER = Number(process.env.RENDER_JOBS_PER_WORKER || 2);
+
+// ------------------ SINGLE PYTHON WORKER ------------------
+class RenderWorker {
+  constructor(id) {
+    this.id = id;
+    this.jobs = new Map(); // jobId -> { onEvent, resolve }
+    this.buffer = '';
+    this.start();
+  }
+
+  start() {
+    this.process = spawn('python', ['-u', CODE_PY_PATH, '--worker', '--jobs', String(JOBS_PER_WORKER)], {
+      cwd: BACKEND_DIR,
+      env: {
+        ...process.env,
+        PYTHONUNBUFFERED: '1' // CRITICAL: Force Python unbuffered output
+      }
+    });
+
+    this.process.stdout.on('data', (data) => {
+      this.buffer += data.toString();
+      const lines = this.buffer.split(/\r?\n/);
+      this.buffer = lines.pop();
+      for (const line of lines) this.handleLine(line.trim());
+    });
+
+    this.process.stderr.on('data', (data) => {
+      console.error(`[RENDER WORKER ${this.id} STDERR]`, data.toString());
+    });
+
+    this.process.on('close', (code) => {
+      console.error(`[RENDER WORKER ${this.id}] exited with code ${code}, restarting`);
+      // Fail whatever was in flight, then come back up for the next job
+      for (const [jobId, job] of this.jobs) {
+        job.resolve({ job: jobId, status: 'error', message: `Render worker exited (code ${code})` });
+      }
+      this.jobs.clear();
+      this.buffer = '';
+      setTimeout(() => this.start(), 1000);
+    });
+
+    this.process.on('error', (err) => {
+      console.error(`[RENDER WORKER ${this.id}] failed to start:`, err);
+    });
+  }
+
+  handleLine(line) {
+    if (!line) return;
+    const match = line.match(/^(PROGRESS|RESULT|SUMMARY|READY|PONG):(.*)$/);
+    if (!match) {
+      console.log(`[RENDER WORKER ${this.id}]`, line);
+      return;
+    }
+
+    let payload;
+    try {
+      payload = JSON.parse(match[2]);
+    } catch (e) {
+      console.error('[ERROR] Failed to parse worker line:', line);
+      return;
+    }
+
+    if (match[1] === 'SUMMARY') {
+      // Per-job stage timings and counters; one line per job, safe to ship to a log pipeline
+      console.log(`[RENDER SUMMARY]`, JSON.stringify(payload));
+      return;
+    }
+
+    const job = this.jobs.get(payload.job);
+    if (!job) return;
+
+    if (match[1] === 'PROGRESS') {
+      job.onEvent(payload);
+    } else if (match[1] === 'RESULT') {
+      this.jobs.delete(payload.job);
+      job.resolve(payload);
+    }
+  }
+
+  send(message) {
+    this.process.stdin.write(JSON.stringify(message) + '\n');
+  }
+
+  submit(request, onEvent) {
+    return new Promise((resolve) => {
+      this.jobs.set(request.id, { onEvent, resolve });
+      this.send(request);
+    });
+  }
+
+  cancel(jobId) {
+    if (this.jobs.has(jobId)) this.send({ cmd: 'cancel', id: jobId });
+  }
+}
+
+// ------------------ POOL ------------------
+class RenderWorkerPool {
+  constructor(size) {
+    this.size = size;
+    this.workers = [];
+  }
+
+  ensureStarted() {
+    // Spawned lazily so the API server starts instantly and never idles Python in dev
+    while (this.workers.length < this.size) {
+      this.workers.push(new RenderWorker(this.workers.length + 1));
+    }
+  }
+
+  /**
+   * Queue a render job on the least busy worker.
+   * Resolves with the worker's RESULT payload: { status, output, renditions, message, elapsed_s }.
+   */
+  submit(request, onEvent = () => {}) {
+    this.ensureStarted();
+    const worker = this.workers.reduce((a, b) => (b.jobs.size < a.jobs.size ? b : a));
+    return worker.submit(request, onEvent);
+  }
+
+  cancel(jobId) {
+    for (const worker of this.workers) worker.cancel(jobId);
+  }
+}
+
+export const renderPool = new RenderWorkerPool(POOL_SIZE);
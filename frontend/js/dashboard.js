@@ -365,6 +365,14 @@ async function startStream(fileId, token) {
 
                 try {
                     const data = JSON.parse(clean);
+
+                    // Preview is a side event: its progress must not move the bar. The link
+                    // opens a new tab, since leaving this page cancels the render.
+                    if (data.stage === 'preview') {
+                        renderState.logs.push({ msg: '▶️ Preview ready - keep this page open while the rest renders and watch it in', type: 'info',
+                                                link: { text: 'My Videos', href: 'videosgen.html' } });
+                        continue;
+                    }
                     
                     if (data.progress !== undefined) {
                         renderState.progress = Math.round(data.progress);
@@ -382,7 +390,6 @@ async function startStream(fileId, token) {
                         handleSuccess();
                         return;
                     }
-                    
                     if (data.message && data.progress === undefined) {
                         renderState.logs.push({ msg: data.message, type: 'info' });
                     }
@@ -423,7 +430,7 @@ function renderLoop() {
     
     if (renderState.logs.length > 0) {
         const log = renderState.logs.shift();
-        addLogToDom(log.msg, log.type);
+        addLogToDom(log.msg, log.type, log.link);
     }
 
     requestAnimationFrame(renderLoop);
@@ -464,7 +471,7 @@ function closeModal() {
     stopKeepAlive();
 }
 
-function addLogToDom(msg, type) {
+function addLogToDom(msg, type, link) {
     const container = document.getElementById('logContainer');
     if (!container) return;
     
@@ -473,6 +480,14 @@ function addLogToDom(msg, type) {
     const div = document.createElement('div');
     div.className = `log-item ${type}`;
     div.textContent = `> ${msg}`;
+    if (link) {
+        const a = document.createElement('a');
+        a.href = link.href;
+        a.target = '_blank';
+        a.rel = 'noopener';
+        a.textContent = link.text;
+        div.append(' ', a);
+    }
     container.appendChild(div);
     container.scrollTop = container.scrollHeight;
 }
@@ -3,6 +3,7 @@ const API_BASE = "http://127.0.0.1:5000/api";
 
 // ------------------ GLOBAL STATE ------------------
 let currentVideo = null;
+let hlsPlayer = null; // hls.js instance while a stream is open in the modal
 window.videosCache = []; // Stores all videos (local + external)
 
 // ------------------ INITIALIZATION ------------------
@@ -53,15 +54,21 @@ async function fetchUserVideos() {
         let generatedVideos = [];
 
         if (data.success) {
+            // Assumes server serves /uploads at root level
+            const uploadsUrl = (relPath) => relPath ? `${API_BASE.replace('/api', '')}/uploads/${relPath}` : '';
+
             // Map videos with their actual status from backend
             generatedVideos = data.videos.map(file => ({
                 id: file._id,
                 title: file.originalName.replace(/\.[^/.]+$/, "") + " Analysis", // Remove extension, add suffix
                 date: file.updatedAt,
-                status: 'Completed', // All videos are completed
+                // Processing videos are listed once their HLS preview is playable
+                status: file.status === 'processing' ? 'Processing' : 'Completed',
                 // CRITICAL: Construct the full URL to the video file
-                // Assumes server serves /uploads at root level
-                source: file.videoPath ? `${API_BASE.replace('/api', '')}/uploads/${file.videoPath}` : '',
+                source: file.status === 'processing' ? '' : uploadsUrl(file.videoPath),
+                previewSource: uploadsUrl(file.previewPath), // 720p rendition for small screens
+                hls: uploadsUrl(file.hlsPath),
+                thumbnail: uploadsUrl(file.thumbnailPath),
                 type: 'local', // Marker for internal video
                 size: file.size || 'Unknown',
                 duration: 'Unknown' // Duration isn't stored in DB yet
@@ -131,6 +138,14 @@ function renderVideoGrid(videos) {
                     </div>
                 </div>
             `;
+        } else if (video.thumbnail) {
+            thumbnailHtml = `
+                <div class="video-thumbnail">
+                    <img src="${video.thumbnail}" alt="" loading="lazy" style="position:absolute; inset:0; width:100%; height:100%; object-fit:cover;">
+                    <div class="play-icon">▶</div>
+                    ${video.duration !== 'Unknown' ? `<div class="video-duration">${video.duration}</div>` : ''}
+                </div>
+            `;
         } else {
             thumbnailHtml = `
                 <div class="video-thumbnail">
@@ -149,7 +164,7 @@ function renderVideoGrid(videos) {
                 <div class="video-title">${video.title}</div>
                 <div class="video-meta">
                     <span>${new Date(video.date).toLocaleDateString()}</span>
-                    <span class="video-status ${video.type === 'external' ? 'status-external' : 'status-completed'}">${video.type === 'external' ? video.status : 'Completed'}</span>
+                    <span class="video-status ${video.type === 'external' ? 'status-external' : video.status === 'Processing' ? 'status-processing' : 'status-completed'}">${video.status}</span>
                 </div>
                 <div class="video-actions">
                     <button class="action-btn" onclick="event.stopPropagation(); downloadVideo('${video.id}')">Download</button>
@@ -178,12 +193,16 @@ function openVideoModal(videoId) {
     if(sizeEl) sizeEl.textContent = formatFileSize(video.size);
     if(durEl) durEl.textContent = video.duration;
 
+    const statusEl = document.getElementById('modalStatus');
+    if (statusEl) {
+        const processing = video.status === 'Processing';
+        statusEl.textContent = processing ? '⏳ Rendering - playing what is ready' : '✓ Completed';
+        statusEl.style.color = processing ? '#f59e0b' : '#22c55e';
+    }
+
     // Setup Player
     const player = document.getElementById('videoPlayer');
-    if (player) {
-        player.src = video.source;
-        player.load();
-    }
+    if (player) attachVideoSource(player, video);
 
     // Show Modal
     const modal = document.getElementById('videoModal');
@@ -191,6 +210,26 @@ function openVideoModal(videoId) {
     modal.style.display = 'flex';
 }
 
+function attachVideoSource(player, video) {
+    player.poster = video.thumbnail || '';
+
+    // Still rendering: play the growing HLS playlist (natively on Safari/iOS, else via hls.js)
+    if (video.status === 'Processing' && video.hls) {
+        if (player.canPlayType('application/vnd.apple.mpegurl')) {
+            player.src = video.hls;
+        } else if (window.Hls && Hls.isSupported()) {
+            hlsPlayer = new Hls();
+            hlsPlayer.loadSource(video.hls);
+            hlsPlayer.attachMedia(player);
+        }
+        return;
+    }
+
+    const smallScreen = window.matchMedia('(max-width: 768px)').matches;
+    player.src = smallScreen && video.previewSource ? video.previewSource : video.source;
+    player.load();
+}
+
 function closeVideoModal() {
     const modal = document.getElementById('videoModal');
     modal.classList.remove('show');
@@ -200,7 +239,11 @@ function closeVideoModal() {
     const player = document.getElementById('videoPlayer');
     if (player) {
         player.pause();
-        player.src = "";
+        if (hlsPlayer) {
+            hlsPlayer.destroy();
+            hlsPlayer = null;
+        }
+        player.removeAttribute('src');
     }
 }
 
@@ -208,6 +251,10 @@ function closeVideoModal() {
 function downloadVideo(videoId) {
     const video = window.videosCache.find(v => v.id === videoId);
     if (!video) return;
+    if (!video.source) {
+        alert("This video is still rendering. Try again when it has finished.");
+        return;
+    }
 
     // Create a direct download link to the video file
     const link = document.createElement('a');
@@ -284,6 +331,7 @@ function filterAndRender() {
         const matchesSearch = v.title.toLowerCase().includes(searchTerm);
         const matchesStatus = statusType === 'all' ? true :
                               statusType === 'completed' ? (v.status === 'Completed' || v.type === 'external') :
+                              statusType === 'processing' ? v.status === 'Processing' :
                               statusType === 'external' ? v.status === 'External' : true;
         return matchesSearch && matchesStatus;
     });
@@ -305,7 +353,7 @@ function updateStatsBar(videos) {
     if (statItems.length >= 4) {
         statItems[0].textContent = totalVideos;
         statItems[1].textContent = completedVideos;
-        statItems[2].textContent = 0; // No processing videos
+        statItems[2].textContent = videos.filter(v => v.status === 'Processing').length;
         statItems[3].textContent = formatFileSize(totalSize);
     }
 }